@@ -31,10 +31,16 @@ from qgis.PyQt.QtWidgets import QTableWidgetItem, QFileDialog, QMessageBox
 import cv2
 import numpy as np
 import tempfile
+import shutil
+import sys
 import os
 
 from .interface_tools import errorMessage
 
+# Import PyLC class raster tools
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'pylc_ia'))
+from utils.tools import read_class_raster, save_class_raster, is_class_raster
+
 def checkForImgs(canvas_list, name_list, button_list):
     """Ensures one image per canvas before enabling tool buttons"""
     
@@ -432,6 +438,40 @@ def switchLayer(comboBox, main_canvas, side_canvas, dlg):
         print("got here 2")
         side_canvas.setLayers(side_list)
 
+def warpBands(src, matrix, out, band_h=256):
+    """Aligns single-band array in row bands (reads only the source region of each band, e.g. from a memory-mapped array)"""
+
+    src_h, src_w = src.shape[:2]
+    h, w = out.shape[:2]
+    inv = np.linalg.inv(matrix)
+
+    for y0 in range(0, h, band_h):
+        y1 = min(h, y0 + band_h)
+
+        # find source region of band from its corners
+        corners = np.array([[0, y0, 1], [w, y0, 1], [0, y1, 1], [w, y1, 1]], dtype=np.float64).T
+        src_pts = inv @ corners
+        if np.all(src_pts[2] > 0):
+            xs = src_pts[0] / src_pts[2]
+            ys = src_pts[1] / src_pts[2]
+            sx0, sx1 = int(max(0, np.floor(xs.min()) - 2)), int(min(src_w, np.ceil(xs.max()) + 3))
+            sy0, sy1 = int(max(0, np.floor(ys.min()) - 2)), int(min(src_h, np.ceil(ys.max()) + 3))
+        else:
+            # band crosses the horizon of the transform (use full source)
+            sx0, sx1, sy0, sy1 = 0, src_w, 0, src_h
+
+        if sx0 >= sx1 or sy0 >= sy1:
+            out[y0:y1] = 0 # band outside source image
+            continue
+
+        # shift transform to source region and band
+        shift = np.array([[1, 0, sx0], [0, 1, sy0], [0, 0, 1]], dtype=np.float64)
+        band = np.array([[1, 0, 0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+        region = np.ascontiguousarray(src[sy0:sy1, sx0:sx1], dtype=out.dtype)
+        out[y0:y1] = cv2.warpPerspective(region, band @ matrix @ shift, (w, y1 - y0), flags = cv2.INTER_NEAREST)
+
+    return out
+
 def alignImgs(dlg, source_img_path, table):
     """Aligns images using perspective transformation"""
     
@@ -482,7 +522,12 @@ def alignImgs(dlg, source_img_path, table):
 
     # align mask if provided
     if dlg.Mask_lineEdit.text():
-        mask = cv2.imread(dlg.Mask_lineEdit.text())
+        # PyLC class rasters are aligned as class indices
+        raster = read_class_raster(dlg.Mask_lineEdit.text())
+        if raster is not None:
+            mask, palette = raster
+        else:
+            mask = cv2.imread(dlg.Mask_lineEdit.text())
         img_h, img_w = img.shape[:2]
         mask_h, mask_w = mask.shape[:2]
         if img_h != mask_h or img_w != mask_w:
@@ -495,24 +540,43 @@ def alignImgs(dlg, source_img_path, table):
         mask_path, ext = os.path.splitext(os.path.realpath(dlg.Mask_lineEdit.text()))
         probs_path = os.path.join(mask_path + '.npy')
         if os.path.isfile(probs_path):
-            # if probability layer exists, align and save to temporary file
-            probs = np.load(probs_path)
-            probs = probs.astype(np.float32)
-            aligned_probs = cv2.warpPerspective(probs, matrix, (w, h), flags = cv2.INTER_NEAREST) # align probability layer with same 
-            # save aligned probabilities to temporary file
+            # if probability layer exists, align in row bands into a memory-mapped temporary file
+            probs = np.load(probs_path, mmap_mode='r')
             dlg.aligned_probs_path = os.path.join(tempfile.mkdtemp(), 'alignedProbs.npy')
             if os.path.isfile(dlg.aligned_probs_path):
                 # check if the temporary file already exists
                 os.remove(dlg.aligned_probs_path)
-            np.save(dlg.aligned_probs_path, aligned_probs)
+            aligned_probs = np.lib.format.open_memmap(
+                dlg.aligned_probs_path, mode='w+', dtype=np.float32, shape=(h, w))
+            warpBands(probs, matrix, aligned_probs) # align probability layer with same transform
+            aligned_probs.flush()
+            del aligned_probs, probs
+
+        # check for per-class probabilities (PyLC output)
+        class_probs_path = os.path.join(mask_path + '_classprobs.npy')
+        dlg.aligned_class_probs_path = None
+        if os.path.isfile(class_probs_path):
+            # align class planes in row bands into a memory-mapped temporary file
+            class_probs = np.load(class_probs_path, mmap_mode='r')
+            dlg.aligned_class_probs_path = os.path.join(tempfile.mkdtemp(), 'alignedClassProbs.npy')
+            aligned_class_probs = np.lib.format.open_memmap(
+                dlg.aligned_class_probs_path, mode='w+', dtype=np.uint8, shape=(class_probs.shape[0], h, w))
+            for i, plane in enumerate(class_probs):
+                warpBands(plane, matrix, aligned_class_probs[i])
+            aligned_class_probs.flush()
+            del aligned_class_probs, class_probs
 
         # save aligned mask to temporary file
-        dlg.aligned_mask_path = os.path.join(tempfile.mkdtemp(), 'alignedMask.tiff')
+        mask_name = 'alignedMask.png' if raster is not None else 'alignedMask.tiff'
+        dlg.aligned_mask_path = os.path.join(tempfile.mkdtemp(), mask_name)
         if os.path.isfile(dlg.aligned_mask_path):
             # check if the temporary file already exists
             os.remove(dlg.aligned_mask_path)
     
-        cv2.imwrite(dlg.aligned_mask_path, aligned_mask)
+        if raster is not None:
+            save_class_raster(dlg.aligned_mask_path, aligned_mask, palette)
+        else:
+            cv2.imwrite(dlg.aligned_mask_path, aligned_mask)
 
         addImg(dlg.aligned_mask_path,"Aligned Mask",dlg.SourceImg_canvas, True) # show aligned mask in side-by-side
         
@@ -566,6 +630,7 @@ def saveAlign(dlg):
     """Saves aligned image or mask to specified location"""
 
     img_to_save = dlg.Layer_comboBox.currentText()
+    class_raster = False
 
     if img_to_save == "" or img_to_save == "Aligned Image":
         if dlg.aligned_img_path is None:
@@ -576,18 +641,27 @@ def saveAlign(dlg):
         if dlg.aligned_mask_path is None:
             errorMessage("No aligned mask")
             return
-        aligned_img = cv2.imread(dlg.aligned_mask_path)
+        class_raster = is_class_raster(dlg.aligned_mask_path)
+        aligned_img = None if class_raster else cv2.imread(dlg.aligned_mask_path)
 
     # open save dialog and save aligned image
     dialog = QFileDialog()
     dialog.setOption(dialog.DontUseNativeDialog)
-    dialog.setNameFilter("TIFF format (*.tiff *.TIFF)")
-    dialog.setDefaultSuffix("tiff")
+    if class_raster:
+        # PyLC class raster: saved as is (single-band PNG with colour table)
+        dialog.setNameFilter("PNG format (*.png *.PNG)")
+        dialog.setDefaultSuffix("png")
+    else:
+        dialog.setNameFilter("TIFF format (*.tiff *.TIFF)")
+        dialog.setDefaultSuffix("tiff")
     dialog.setAcceptMode(QFileDialog.AcceptSave)
 
     if dialog.exec_():
         align_path = dialog.selectedFiles()[0]
-        cv2.imwrite(align_path, aligned_img)
+        if class_raster:
+            shutil.copyfile(dlg.aligned_mask_path, align_path)
+        else:
+            cv2.imwrite(align_path, aligned_img)
     
         if img_to_save == "" or img_to_save == "Aligned Image":
             dlg.refresh_dict["Align"]["Img"]=align_path
@@ -596,9 +670,13 @@ def saveAlign(dlg):
 
         if dlg.aligned_probs_path:
             #check for probability layer (PyLC output)
-            aligned_probs = np.load(dlg.aligned_probs_path)
             mask_path, ext = os.path.splitext(align_path)
             probs_path = os.path.join(mask_path + '.npy')
-            np.save(probs_path, aligned_probs)
+            shutil.copyfile(dlg.aligned_probs_path, probs_path)
+
+        if dlg.aligned_class_probs_path:
+            #check for per-class probabilities (PyLC output)
+            mask_path, ext = os.path.splitext(align_path)
+            shutil.copyfile(dlg.aligned_class_probs_path, os.path.join(mask_path + '_classprobs.npy'))
     else:
         return
\ No newline at end of file
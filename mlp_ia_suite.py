@@ -204,6 +204,7 @@ class MLP_IA_Suite:
         # PYLC TAB 
         self.dlg.PyLC_path = None # initiate variable to hold path to mask (for temp file)
         self.dlg.pylc_run = False # initiate variable to check whether PyLC ran already
+        self.dlg.pylc_result = None # initiate variable to hold PyLC result (outputs are saved from it)
 
         # Set up image scale slider
         self.dlg.Scale_slider.valueChanged['int'].connect(lambda: setScaleBoxVal(self.dlg, self.dlg.Scale_slider.value()))
@@ -297,6 +298,7 @@ class MLP_IA_Suite:
         self.dlg.aligned_mask_path = None # initiate variable to hold path to aligned mask
         self.dlg.CPtool = None # initiate variable for control point tool
         self.dlg.aligned_probs_path = None
+        self.dlg.aligned_class_probs_path = None
         
         # Get file/folder inputs and display images
         self.dlg.SourceImg_button.clicked.connect(lambda: getFile(self.dlg.SourceImg_lineEdit, "Images (*.jpeg *.jpg *.png *.tif *.TIF *.tiff *.TIFF)"))
@@ -339,6 +341,7 @@ class MLP_IA_Suite:
 
         self.dlg.vs_path = None # initiate variable to hold path to VP (for temp file)
         self.dlg.probs_lyr_path = None # initiate variable to hold path to probabilities layer
+        self.dlg.class_probs_lyr_path = None # initiate variable to hold path to per-class probabilities
         
         # Get file/folder inputs
         self.dlg.DEM_button.clicked.connect(lambda: getFile(self.dlg.DEM_lineEdit, "TIF format (*.tif *.TIF *.tiff *.TIFF)"))
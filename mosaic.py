@@ -35,6 +35,7 @@ from PyQt5.QtCore import Qt
 from qgis import processing
 
 from .interface_tools import errorMessage,  loadLayer
+from .vs_creation import SB_CODES
 
 def addLayer(filter_string, listWidget):
     """Users provides raster layer to add to list"""
@@ -163,7 +164,7 @@ def addProbs(input_layers):
 def probMosaic(input_lyrs, input_probs):
     """Mosaics a set of rasters based on classification probability"""
 
-    n_classes = 9 # number of unique LC classes
+    n_classes = max(SB_CODES.values()) # number of LC classes in singleband legend (1 to n, 0 is ND)
 
     all_class_probs = []
 
@@ -217,6 +218,64 @@ def probMosaic(input_lyrs, input_probs):
     
     return probs_mosaic_path
        
+def classProbMosaic(input_lyrs, input_class_probs):
+    """Mosaics a set of rasters based on per-class probabilities (read lazily, one class layer at a time)"""
+
+    layers = [QgsRasterLayer(os.path.realpath(path), os.path.basename(path)) for path in input_lyrs]
+    class_probs = [np.load(path, mmap_mode='r') for path in input_class_probs]
+
+    # mosaic extent covers all inputs (same CRS and resolution)
+    resX = layers[0].rasterUnitsPerPixelX()
+    resY = layers[0].rasterUnitsPerPixelY()
+    xmin = min(lyr.extent().xMinimum() for lyr in layers)
+    xmax = max(lyr.extent().xMaximum() for lyr in layers)
+    ymin = min(lyr.extent().yMinimum() for lyr in layers)
+    ymax = max(lyr.extent().yMaximum() for lyr in layers)
+    w = round((xmax - xmin)/resX)
+    h = round((ymax - ymin)/resY)
+
+    # find position of each input in mosaic
+    windows = []
+    for lyr, probs in zip(layers, class_probs):
+        if probs.shape[1:] != (lyr.height(), lyr.width()):
+            errorMessage("Per-class probabilities do not match raster dimensions:\n" + lyr.source())
+            return
+        col = round((lyr.extent().xMinimum() - xmin)/resX)
+        row = round((ymax - lyr.extent().yMaximum())/resY)
+        windows.append((row, col, min(lyr.height(), h - row), min(lyr.width(), w - col)))
+
+    # sum class probabilities across inputs and keep most probable class (1 to n, 0 is ND)
+    n_classes = max(SB_CODES.values()) # number of LC classes in singleband legend
+    summed = np.zeros((h, w), dtype=np.uint16)
+    max_probs = np.zeros((h, w), dtype=np.uint16)
+    mosaic = np.zeros((h, w), dtype=np.uint8)
+    for n in range(n_classes):
+        summed[:] = 0
+        for (row, col, lyr_h, lyr_w), probs in zip(windows, class_probs):
+            if n < probs.shape[0]:
+                summed[row:row + lyr_h, col:col + lyr_w] += probs[n, :lyr_h, :lyr_w]
+        update = summed > max_probs
+        max_probs[update] = summed[update]
+        mosaic[update] = n + 1
+
+    # write mosaic to image and convert to referenced raster layer
+    mosaic_path = os.path.join(tempfile.mkdtemp(), 'tempMosaic.tiff')
+    cv2.imwrite(mosaic_path, mosaic)
+
+    ullr = " ".join(["-a_ullr", str(xmin), str(ymax), str(xmin + w*resX), str(ymax - h*resY)])
+    PARAMS = { 'COPY_SUBDATASETS' : False, 
+              'DATA_TYPE' : 0, 
+              'EXTRA' : ullr, 
+              'INPUT' : mosaic_path, 
+              'NODATA' : "0", 
+              'OPTIONS' : '', 
+              'OUTPUT' : 'TEMPORARY_OUTPUT', 
+              'TARGET_CRS' : layers[0].crs() }
+
+    mosaic_ref = processing.run("gdal:translate", PARAMS)
+
+    return mosaic_ref['OUTPUT']
+
 def mosaicRasters(listWidget, ranking_checkBox, dlg):
     """Mosaics provided rasters together"""
 
@@ -226,6 +285,13 @@ def mosaicRasters(listWidget, ranking_checkBox, dlg):
        paths_reversed = input_raster_paths[::-1] # reverse order for mosaic
        dlg.mosaic_path = gdalModeMosaic(paths_reversed)
     
+    elif all(os.path.isfile(os.path.splitext(path)[0] + '_classprobs.npy') for path in input_raster_paths):
+        # per-class probabilities exist for all inputs (PyLC output)
+        class_prob_paths = [os.path.join(os.path.splitext(path)[0] + '_classprobs.npy') for path in input_raster_paths]
+        dlg.mosaic_path = classProbMosaic(input_raster_paths, class_prob_paths)
+        if dlg.mosaic_path is None:
+            return
+
     else:
         prob_paths = []
         for path in input_raster_paths:
@@ -19,7 +19,24 @@ import numpy as np
 import torch
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from interface_tools import errorMessage
+from utils.control import PyLCError
+
+
+def get_cache_dir():
+    """
+    Returns the user cache directory of PyLC (outside the install
+    directory, so cached artifacts and results persist across updates):
+        - Windows: %LOCALAPPDATA%\\pylc\\cache
+        - macOS: ~/Library/Caches/pylc
+        - Linux: $XDG_CACHE_HOME/pylc (default: ~/.cache/pylc)
+    """
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+        return os.path.join(base, 'pylc', 'cache')
+    if sys.platform == 'darwin':
+        return os.path.join(os.path.expanduser('~'), 'Library', 'Caches', 'pylc')
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'pylc')
+
 
 class Parameters:
     """
@@ -58,6 +75,16 @@ class Parameters:
         Image scaling factors.
     args.stride: int
         Stride.
+    args.pyramid_scales: list
+        Image scaling factors for multi-scale inference (probabilities fused at args.scale).
+    args.recon_type: str
+        Tile reconstruction engine: 'stitch' (default), 'accumulate', 'stream'.
+    args.read_type: str
+        Image reader: 'full' (default), 'auto', 'windowed' (TIFF windowed reads).
+    args.mask_format: str
+        Mask output: 'rgb' (default, colour PNG), 'index' (single-band class index PNG with colour table).
+    args.window_mem: int
+        Image size (MB) above which 'auto' uses windowed reads.
     args.m2: float
         M2 variance metric.
     args.jsd: float
@@ -82,6 +109,59 @@ class Parameters:
     args.partition: float
         Fraction of the dataset held out for validation during training.
 
+    args.batch_size: int|str
+        Number of tiles per forward pass ('auto' fits batch to memory budget).
+    args.batch_mem: int
+        Memory budget for automatic batch sizing (MB).
+    args.px_bytes: int
+        Estimated inference memory per tile pixel (bytes).
+    args.model_cache_size: int
+        Number of loaded models kept in memory between runs.
+    args.fast_cpu: bool
+        Optimized inference (folded batch norm, channels-last, inference mode).
+    args.n_threads: int
+        Number of CPU threads used for inference (0: torch default).
+    args.jit: bool
+        Use compiled (TorchScript) network cached by model file hash.
+    args.output_dir: str
+        Output directory for directory batch mode (<stem>_mask.png, <stem>_probs.npy).
+    args.overwrite: bool
+        Regenerate up-to-date outputs in directory batch mode.
+    args.pipeline: bool
+        Overlap decoding, inference and output of consecutive images.
+    args.n_prefetch: int
+        Number of images decoded ahead in pipelined mode.
+    args.profile_report: str
+        Save stage-level profiling report (JSON) to path.
+    args.profile_trace: str
+        Save torch.profiler trace (Chrome trace format) to path.
+    args.n_procs: int
+        Number of worker processes for process pool batch mode (shared model weights, CPU only).
+    args.quantize: bool
+        Use int8 quantized network (CPU only).
+    args.n_calib: int
+        Number of input tiles used to calibrate quantization.
+    args.save_class_probs: bool
+        Save per-class probabilities (uint8, memory-mappable .npy [CHW]).
+    args.result_cache: bool
+        Restore outputs of previously classified images from the persistent result cache.
+    args.result_cache_size: int
+        Result cache size limit (MB); least recently used results are evicted.
+    args.cache_dir: str
+        Cache directory of compiled networks and results (default: user cache directory).
+    args.result_cache_dir: str
+        Result cache directory (default: <cache_dir>/results).
+    args.uniform_tiles: bool
+        Fill near-uniform tiles (e.g. sky) with cached predictions of the same appearance.
+    args.uniform_std: float
+        Maximum per-channel standard deviation (uint8 levels) of uniform tiles.
+    args.uniform_bucket: int
+        Quantization step of channel means keying cached uniform tile predictions.
+    args.uniform_check: bool
+        Also classify filled tiles and report agreement with the cached predictions.
+    args.uniform_cache_size: int
+        Size limit (MB) of cached uniform tile predictions (least recently used are evicted).
+
     """
 
     def __init__(self, args=None):
@@ -95,6 +175,24 @@ class Parameters:
         # Device settings
         self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
         self.n_workers = 0
+        self.n_threads = 0
+        self.fast_cpu = False
+        self.pipeline = False
+        self.overwrite = False
+        self.n_prefetch = 2
+        self.n_procs = 0
+        self.profile_report = None
+        self.profile_trace = None
+        self.jit = False
+        self.quantize = False
+        self.n_calib = 16
+        self.result_cache = False
+        self.result_cache_size = 1024
+        self.uniform_tiles = False
+        self.uniform_std = 4.
+        self.uniform_bucket = 8
+        self.uniform_check = False
+        self.uniform_cache_size = 256
 
         # Application run modes
         self.TRAIN = 'train'
@@ -133,6 +231,8 @@ class Parameters:
         self.output_dir = os.path.join(this_dir,'data','outputs')
         self.save_dir = os.path.join(this_dir,'data','save')
         self.model_dir = os.path.join(this_dir,'data','models')
+        self.cache_dir = get_cache_dir()
+        self.result_cache_dir = os.path.join(self.cache_dir,'results')
         self.meta_grayscale_path = os.path.join(this_dir,'data','metadata','meta_ch1_schema_a.npy')
         self.meta_colour_path = os.path.join(this_dir,'data','metadata','meta_ch3_schema_a.npy')
 
@@ -143,10 +243,24 @@ class Parameters:
         self.scale = 1.
         # self.scales = [0.2, 0.5, 1.]
         self.scales = [1.]
+        self.pyramid_scales = []
         self.tiling_factor = 2000
         self.tiles_per_image = int(sum(self.tiling_factor * self.scales))
         self.tile_px_count = self.tile_size * self.tile_size
 
+        # Reconstruction parameters
+        self.recon_options = ['stitch', 'accumulate', 'stream']
+        self.recon_type = self.recon_options[0]
+
+        # Mask output format
+        self.mask_options = ['rgb', 'index']
+        self.mask_format = self.mask_options[0]
+
+        # Image reader parameters
+        self.read_options = ['full', 'auto', 'windowed']
+        self.read_type = self.read_options[0]
+        self.window_mem = 1024
+
         # Data Augmentation Parameters
         self.aug_n_samples_ratio = 0.36
         self.aug_oversample_rate_range = (0, 4)
@@ -193,6 +307,9 @@ class Parameters:
         self.pretrained = './data/models/resnet101-5d3b4d8f.pth'
         self.n_epochs = 20
         self.batch_size = 8
+        self.model_cache_size = 2
+        self.batch_mem = 2048
+        self.px_bytes = 512
         self.dropout = 0.5
         self.crop_target = False
         self.lr = 0.0001
@@ -228,6 +345,7 @@ class Parameters:
 
         # metrics
         self.save_probs = True
+        self.save_class_probs = False
 
         # update parameters with user-defined arguments
         if args:
@@ -243,6 +361,9 @@ class Parameters:
             User-defined arguments.
         """
         params = args if type(args) == dict else vars(args)
+        # result cache follows user-defined cache directory (unless set)
+        if params.get('cache_dir') and not params.get('result_cache_dir'):
+            params = dict(params, result_cache_dir=os.path.join(params['cache_dir'], 'results'))
         # update parameters by property names
         for key in params:
             if hasattr(self, key):
@@ -281,8 +402,7 @@ class Parameters:
 
         # Get schema settings from local JSON file
         if not os.path.isfile(schema_path):
-            errorMessage('Schema file not found:\n\t{}'.format(schema_path))
-            return
+            raise PyLCError('Schema file not found:\n\t{}'.format(schema_path))
 
         class Schema(object):
             pass
@@ -35,3 +35,15 @@ class DeepLab(nn.Module):
         x = F.interpolate(x, size=input.size()[2:], mode='bilinear', align_corners=True)
         return x
 
+    def fuse_bn(self):
+        """
+        Fold batch normalization layers into preceding convolutions
+        for inference. Network must be in eval mode.
+        """
+        assert not self.training, 'Batch normalization can only be folded in eval mode.'
+        if issubclass(self.normalizer, nn.modules.batchnorm._BatchNorm):
+            self.backbone.fuse_bn()
+            self.aspp.fuse_bn()
+            self.decoder.fuse_bn()
+        return self
+
@@ -9,6 +9,7 @@ It can use Modified Aligned Xception and ResNet as backbone.
 import math
 import torch
 import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 from config import defaults
 
 
@@ -51,6 +52,16 @@ class Bottleneck(nn.Module):
 
         return out
 
+    def fuse_bn(self):
+        """Fold batch normalization into preceding convolutions (eval mode)."""
+        self.conv1 = fuse_conv_bn_eval(self.conv1, self.bn1)
+        self.conv2 = fuse_conv_bn_eval(self.conv2, self.bn2)
+        self.conv3 = fuse_conv_bn_eval(self.conv3, self.bn3)
+        self.bn1 = self.bn2 = self.bn3 = nn.Identity()
+        if self.downsample is not None:
+            self.downsample = nn.Sequential(fuse_conv_bn_eval(self.downsample[0], self.downsample[1]))
+        return self
+
 
 class ResNet(nn.Module):
 
@@ -133,6 +144,15 @@ class ResNet(nn.Module):
         x = self.layer4(x)
         return x, low_level_feat
 
+    def fuse_bn(self):
+        """Fold batch normalization into preceding convolutions (eval mode)."""
+        self.conv1 = fuse_conv_bn_eval(self.conv1, self.bn1)
+        self.bn1 = nn.Identity()
+        for layer in [self.layer1, self.layer2, self.layer3, self.layer4]:
+            for block in layer:
+                block.fuse_bn()
+        return self
+
     def _init_weight(self):
         for m in self.modules():
             if isinstance(m, nn.Conv2d):
@@ -9,6 +9,7 @@ It can use Modified Aligned Xception and ResNet as backbone.
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 
 class Decoder(nn.Module):
@@ -44,6 +45,16 @@ class Decoder(nn.Module):
 
         return x
 
+    def fuse_bn(self):
+        """Fold batch normalization into preceding convolutions (eval mode)."""
+        self.conv1 = fuse_conv_bn_eval(self.conv1, self.bn1)
+        self.bn1 = nn.Identity()
+        conv1, bn1, relu1, drop1, conv2, bn2, relu2, drop2, conv3 = self.last_conv
+        self.last_conv = nn.Sequential(fuse_conv_bn_eval(conv1, bn1), relu1, drop1,
+                                       fuse_conv_bn_eval(conv2, bn2), relu2, drop2,
+                                       conv3)
+        return self
+
     def _init_weight(self):
         for m in self.modules():
             if isinstance(m, nn.Conv2d):
@@ -12,6 +12,13 @@ Module: Base Model Class
 File: model.py
 """
 import os, sys
+import gc
+import copy
+import time
+import json
+import pickle
+import hashlib
+from collections import OrderedDict
 import torch
 import torch.utils.data
 from torch import nn
@@ -21,7 +28,13 @@ import numpy as np
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from models.architectures.deeplab import DeepLab
 from config import defaults
-from utils.tools import get_fname
+from utils.tools import get_fname, file_hash, mk_path
+from utils.evaluate import confusion_matrix, get_iou
+from utils.profiler import profiler
+
+# Process-wide cache of loaded (eval-mode) networks
+# key: (model path, modification time, device, variant)
+_registry = OrderedDict()
 
 
 class Model:
@@ -41,6 +54,17 @@ class Model:
         # build network
         self.net = None
         self.model_path = None
+        self.model_meta = None
+
+        # compiled network (artifact) cache directory
+        self.cache_dir = self.meta.cache_dir
+
+        # network variant ('eager', 'jit', 'int8-<calibration digest>', '<variant>-fast')
+        self.variant = 'eager'
+
+        # optimized inference (fused network, cached normalization)
+        self.fast = False
+        self.px_norm = None
 
         # initialize global iteration counter
         self.iter = 0
@@ -73,7 +97,7 @@ class Model:
             'syncbatch': torch.nn.SyncBatchNorm
         }
 
-    def load(self, model_path):
+    def load(self, model_path, jit=False, cache_dir=None):
         """
         Loads models PyLC model for evaluation.
 
@@ -81,7 +105,14 @@ class Model:
         ----------
         model_path: str
             Path to PyLC models model.
+        jit: bool
+            Use compiled (TorchScript) network. The network is compiled
+            on first use and cached by model file hash.
+        cache_dir: str
+            Compiled network cache directory (default: user cache directory).
         """
+        if cache_dir:
+            self.cache_dir = cache_dir
 
         if not model_path:
             print("\nModel path is empty. Use \'--model\' option to specify path.")
@@ -92,6 +123,26 @@ class Model:
         if os.path.exists(model_path):
             self.model_path = model_path
             model_data = None
+            start = time.perf_counter()
+
+            # reuse cached network
+            key = self.get_key('jit' if jit else 'eager')
+            if key in _registry:
+                _registry.move_to_end(key)
+                self.net, meta = _registry[key]
+                self.variant = key[-1]
+                self.model_meta = meta
+                self.meta.update(meta)
+                self.meta.pretrained = False
+                self.gen_id()
+                print('\t(cached)')
+                return self
+
+            # load compiled network
+            if jit and self.load_compiled():
+                self.cache(key)
+                print('{:30s} {:.2f}s'.format('Startup time', time.perf_counter() - start))
+                return self
 
             # load model data
             try:
@@ -105,12 +156,23 @@ class Model:
             assert 'meta' in model_data, '\nLoaded model missing metadata attribute.'
 
             # build model from metadata
-            self.meta.update(model_data["meta"])
+            self.model_meta = model_data["meta"]
+            self.meta.update(self.model_meta)
             self.meta.pretrained = False
             self.build()
 
             # load model state
             self.net.load_state_dict(model_data["model"])
+            self.net.eval()
+
+            # compile network (falls back to eager mode)
+            if jit:
+                self.compile()
+
+            # add network to cache
+            self.cache(self.get_key())
+            if jit:
+                print('{:30s} {:.2f}s'.format('Startup time', time.perf_counter() - start))
 
         else:
             print('Model file does not exist.')
@@ -118,6 +180,295 @@ class Model:
 
         return self
 
+    def get_artifact(self, variant='jit', tag=None):
+        """
+        Returns path of compiled network for the loaded model file.
+        Compiled networks are keyed by model file hash and torch version
+        (and tag, e.g. digest of quantization calibration settings).
+
+        Parameters
+        ----------
+        variant: str
+            Compiled network variant ('jit', 'int8').
+        tag: str
+            Artifact tag (optional).
+        """
+        fname = '{}_torch{}{}.pt'.format(
+            file_hash(self.model_path), torch.__version__.split('+')[0], '_' + tag if tag else '')
+        return os.path.join(self.cache_dir, variant, fname)
+
+    def load_compiled(self, variant='jit', tag=None):
+        """
+        Loads compiled (TorchScript) network and model metadata from
+        the artifact cache.
+
+        Parameters
+        ----------
+        variant: str
+            Compiled network variant ('jit', 'int8').
+        tag: str
+            Artifact tag (optional).
+
+        Returns
+        ------
+        bool
+            Compiled network was loaded.
+        """
+        artifact = self.get_artifact(variant, tag)
+        if not os.path.exists(artifact):
+            return False
+        try:
+            extra_files = {'meta.pkl': ''}
+            net = torch.jit.load(artifact, map_location=self.device, _extra_files=extra_files)
+            meta = pickle.loads(extra_files['meta.pkl'])
+        except Exception as err:
+            print('Compiled model could not be loaded (using eager mode):\n\t{}'.format(err))
+            return False
+
+        self.net = net.eval()
+        self.variant = variant
+        self.model_meta = meta
+        self.meta.update(meta)
+        self.meta.pretrained = False
+        self.gen_id()
+        print('\t(compiled: {})'.format(variant))
+        return True
+
+    def compile(self, variant='jit', tag=None):
+        """
+        Compiles loaded network with TorchScript tracing and saves it
+        (with model metadata) to the artifact cache.
+
+        Parameters
+        ----------
+        variant: str
+            Compiled network variant ('jit', 'int8').
+        tag: str
+            Artifact tag (optional).
+
+        Returns
+        ------
+        bool
+            Compiled network was saved to the artifact cache. A network
+            that is traced but cannot be saved is still used in memory.
+        """
+        artifact = self.get_artifact(variant, tag)
+        x = torch.zeros(1, 3, self.meta.tile_size, self.meta.tile_size, device=self.device)
+        try:
+            with torch.no_grad():
+                net = torch.jit.trace(self.net, x, check_trace=False)
+        except Exception as err:
+            print('Model could not be compiled (using eager mode):\n\t{}'.format(err))
+            return False
+
+        self.net = net
+        self.variant = variant
+        try:
+            mk_path(os.path.dirname(artifact))
+            # write to temporary file so partial artifacts are never loaded
+            torch.jit.save(net, artifact + '.tmp', _extra_files={'meta.pkl': pickle.dumps(self.model_meta)})
+            os.replace(artifact + '.tmp', artifact)
+        except Exception as err:
+            print('Compiled model could not be saved (compiled in memory only):\n\t{}'.format(err))
+            return False
+
+        print('{:30s} {}'.format('Compiled model', artifact))
+        return True
+
+    def quantize(self, calib_tiles, calib_settings=None):
+        """
+        Static int8 quantization of the backbone and ASPP modules
+        (CPU only). Activation ranges are calibrated on sample tiles
+        and the int8 network is compared with the fp32 network on
+        held-out sample tiles (per-class IoU). Quantized networks are
+        saved to the artifact cache with the agreement report, keyed by
+        the calibration settings, and reused on later runs.
+
+        Parameters
+        ----------
+        calib_tiles: callable
+            Returns sample tiles [NCHW] (only called if no quantized
+            network is cached). Alternate tiles are used for calibration
+            and held out for the agreement report.
+        calib_settings: dict
+            Calibration settings (e.g. number of tiles, scale, input
+            images) keying the quantized network.
+
+        Returns
+        ------
+        dict
+            Agreement report (saved report if quantized network was cached).
+        """
+        if self.device.type != 'cpu':
+            print('Quantized inference requires CPU device (using {} network).'.format(self.variant))
+            return None
+
+        # reuse quantized network calibrated with the same settings
+        tag = hashlib.sha256(json.dumps(calib_settings or {}, sort_keys=True).encode()).hexdigest()[:16]
+        variant = 'int8-' + tag
+        key = self.get_key(variant)
+        if key in _registry:
+            _registry.move_to_end(key)
+            self.net = _registry[key][0]
+            self.variant = variant
+            return self.load_agreement(tag)
+        if self.load_compiled('int8', tag):
+            self.variant = variant
+            self.cache(key)
+            return self.load_agreement(tag)
+
+        if not isinstance(self.net, DeepLab):
+            print('Quantization requires eager network (using {} network).'.format(self.variant))
+            return None
+
+        try:
+            from torch.ao.quantization import get_default_qconfig_mapping
+            from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+        except ImportError:
+            print('Quantization not supported by installed torch version (using {} network).'.format(self.variant))
+            return None
+
+        print('\nQuantizing model (int8) ...')
+        tiles = torch.as_tensor(calib_tiles())
+        if len(tiles) == 0:
+            print('No calibration tiles available (using {} network).'.format(self.variant))
+            return None
+
+        # alternate tiles are held out for the agreement report (in-sample if only one tile)
+        calib, held_out = (tiles[0::2], tiles[1::2]) if len(tiles) > 1 else (tiles, tiles)
+        batches = torch.split(calib, self.meta.batch_size)
+
+        # insert observers in backbone and ASPP
+        fp32_net = self.net
+        qconfig = get_default_qconfig_mapping(torch.backends.quantized.engine)
+        x = self.normalize_image(tiles[:1].float(), default=self.meta.normalize_default)
+        x = torch.cat((x, x, x), 1) if self.meta.ch == 1 else x
+        with torch.no_grad():
+            features, _ = fp32_net.backbone(x)
+        self.net = copy.deepcopy(fp32_net).eval()
+        self.net.backbone = prepare_fx(self.net.backbone, qconfig, (x,))
+        self.net.aspp = prepare_fx(self.net.aspp, qconfig, (features,))
+
+        # calibrate
+        for batch in batches:
+            self.test(batch)
+
+        self.net.backbone = convert_fx(self.net.backbone)
+        self.net.aspp = convert_fx(self.net.aspp)
+        q_net = self.net
+
+        # compare int8 and fp32 class predictions
+        conf = np.zeros((self.meta.n_classes, self.meta.n_classes), dtype=np.int64)
+        for batch in torch.split(held_out, self.meta.batch_size):
+            self.net = fp32_net
+            y_fp32 = self.test(batch)[0].argmax(1).numpy()
+            self.net = q_net
+            y_int8 = self.test(batch)[0].argmax(1).numpy()
+            conf += confusion_matrix(y_fp32, y_int8, self.meta.n_classes)
+        iou = get_iou(conf)
+        report = {
+            'calib_tiles': len(calib),
+            'held_out_tiles': len(held_out) if len(tiles) > 1 else 0,
+            'settings': calib_settings or {},
+            'iou': {label: None if np.isnan(v) else float(v) for label, v in zip(self.meta.class_labels, iou)},
+            'miou': float(np.nanmean(iou)),
+            'agreement': float(np.trace(conf) / max(conf.sum(), 1))
+        }
+        self.print_agreement(report)
+
+        # save compiled quantized network (with agreement report)
+        if self.compile('int8', tag):
+            with open(self.get_agreement_path(tag), 'w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            print('Warning: quantized network and agreement report were not saved '
+                  '(model is recalibrated in the next run).')
+        self.variant = variant
+        self.cache(key)
+
+        return report
+
+    def get_agreement_path(self, tag):
+        """
+        Returns path of agreement report saved with quantized network.
+
+        Parameters
+        ----------
+        tag: str
+            Artifact tag (digest of calibration settings).
+        """
+        return os.path.splitext(self.get_artifact('int8', tag))[0] + '.json'
+
+    def load_agreement(self, tag):
+        """
+        Loads and prints agreement report saved with quantized network.
+
+        Parameters
+        ----------
+        tag: str
+            Artifact tag (digest of calibration settings).
+        """
+        path = self.get_agreement_path(tag)
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            report = json.load(f)
+        self.print_agreement(report)
+        return report
+
+    @staticmethod
+    def print_agreement(report):
+        """
+        Prints agreement of quantized with fp32 class predictions.
+
+        Parameters
+        ----------
+        report: dict
+            Agreement report: per-class IoU, mean IoU and pixel agreement
+            on held-out tiles.
+        """
+        hline = '-' * 40
+        print('\nQuantization Agreement (int8 vs fp32)')
+        print(hline)
+        print('{:30s} {}'.format('Calibration tiles', report['calib_tiles']))
+        print('{:30s} {}'.format('Held-out tiles', report['held_out_tiles'] or 'none (in-sample)'))
+        for label, v in report['iou'].items():
+            print('   - {:25s} {}'.format(label, 'n/a' if v is None else '{:.4f}'.format(v)))
+        print('{:30s} {:.4f}'.format('Mean IoU', report['miou']))
+        print('{:30s} {:.2f}%'.format('Pixel agreement', 100 * report['agreement']))
+        print(hline)
+
+    def get_key(self, variant=None):
+        """
+        Returns model cache key (path, modification time, device, variant).
+
+        Parameters
+        ----------
+        variant: str
+            Network variant (default: current variant).
+        """
+        variant = variant if variant is not None else self.variant
+        return os.path.realpath(self.model_path), os.path.getmtime(self.model_path), str(self.device), variant
+
+    def cache(self, key):
+        """
+        Adds network to process-wide model cache. Stale entries for
+        the same model file are dropped and the least recently used
+        entries are evicted beyond the cache size.
+
+        Parameters
+        ----------
+        key: tuple
+            Model cache key.
+        """
+        if defaults.model_cache_size < 1:
+            return
+        for k in [k for k in _registry if k[0] == key[0] and k[1] != key[1]]:
+            del _registry[k]
+        _registry[key] = (self.net, self.model_meta)
+        while len(_registry) > defaults.model_cache_size:
+            _registry.popitem(last=False)
+
     def build(self):
         """
         Builds neural network model from configuration settings.
@@ -163,23 +514,146 @@ class Model:
 
         """model test forward"""
 
+        if self.fast:
+            return self.test_fast(x)
+
         # normalize
-        x = self.normalize_image(x, default=self.meta.normalize_default)
-        x = x.to(self.device).float()
+        with profiler.stage('normalize'):
+            x = self.normalize_image(x, default=self.meta.normalize_default)
+            x = x.to(self.device).float()
 
-        # stack single-channel input tensors (Deeplab)
-        if self.meta.ch == 1 and self.meta.arch == 'deeplab':
-            x = torch.cat((x, x, x), 1)
+            # stack single-channel input tensors (Deeplab)
+            if self.meta.ch == 1 and self.meta.arch == 'deeplab':
+                x = torch.cat((x, x, x), 1)
 
         # run forward pass
-        with torch.no_grad():
+        with torch.no_grad(), profiler.stage('forward'):
             y_hat = self.net.forward(x)
             return [y_hat]
 
+    def test_fast(self, x):
+        """
+        Optimized model test forward (see optimize()).
+            - normalization with cached device constants
+            - channels-last memory format
+            - inference mode (no autograd tracking)
+        """
+        px_mean, px_std, px_scale = self.px_norm
+        with inference_mode():
+            with profiler.stage('normalize'):
+                x = x.to(self.device, dtype=torch.float32)
+                x = ((x - px_mean) / px_std) / px_scale
+
+                # stack single-channel input tensors (Deeplab)
+                if self.meta.ch == 1 and self.meta.arch == 'deeplab':
+                    x = torch.cat((x, x, x), 1)
+
+            with profiler.stage('forward'):
+                y_hat = self.net(x.contiguous(memory_format=torch.channels_last))
+            return [y_hat]
+
+    def optimize(self, n_threads=None):
+        """
+        Prepares loaded network for fast (CPU) inference:
+            - folds batch normalization into convolution weights
+            - converts weights to channels-last memory format
+            - caches pixel normalization constants on device
+            - sets number of intra-op threads (optional)
+        The optimized network is a copy kept in the model cache
+        alongside the original.
+
+        Parameters
+        ----------
+        n_threads: int
+            Number of CPU threads used for inference (default: torch setting).
+        """
+        if n_threads:
+            torch.set_num_threads(int(n_threads))
+
+        key = self.get_key(self.variant + '-fast')
+        if key in _registry:
+            _registry.move_to_end(key)
+            self.net = _registry[key][0]
+        elif isinstance(self.net, torch.jit.ScriptModule):
+            # compiled network: freeze graph and fold batch normalization
+            self.net = torch.jit.optimize_for_inference(torch.jit.freeze(self.net.eval()))
+            self.cache(key)
+        elif isinstance(self.net, DeepLab):
+            self.net = copy.deepcopy(self.net).eval()
+            # quantized modules already have batch normalization folded (convert_fx)
+            if not self.variant.startswith('int8'):
+                self.net.fuse_bn()
+            self.net = self.net.to(memory_format=torch.channels_last)
+            self.cache(key)
+        self.variant = key[-1]
+
+        self.px_norm = self.get_norm(default=self.meta.normalize_default)
+        self.fast = True
+
+        print('{:30s} {}'.format('Fast inference', 'enabled'))
+        print('   - {:25s} {}'.format('Threads', torch.get_num_threads()))
+
+        return self
+
+    def get_norm(self, default=False):
+        """
+        Returns pixel normalization constants as device tensors
+        (mean [1C11], std [1C11], scale), equivalent to normalize_image().
+
+        Parameters
+        ----------
+        default: bool
+            Use default pixel mean/std deviation values.
+        """
+        # grayscale
+        if self.meta.ch == 1:
+            if default:
+                mean, std, scale = defaults.px_grayscale_mean, defaults.px_grayscale_std, 1.
+            else:
+                mean, std, scale = np.mean(self.meta.px_mean), np.mean(self.meta.px_std), 255.
+            mean, std = [mean], [std]
+        # colour
+        elif default:
+            mean, std, scale = defaults.px_rgb_mean, defaults.px_rgb_std, 255.
+        else:
+            mean, std, scale = self.meta.px_mean, self.meta.px_std, 255.
+
+        mean = torch.tensor(mean, dtype=torch.float32, device=self.device)[None, :, None, None]
+        std = torch.tensor(std, dtype=torch.float32, device=self.device)[None, :, None, None]
+        return mean, std, scale
+
     def get_meta(self):
         """Get model metadata."""
         return self.meta
 
+    def get_batch_size(self, n_tiles, batch_size=None, mem_budget=None):
+        """
+        Resolve number of tiles per forward pass.
+            - 'auto' selects the largest batch that fits the memory budget
+
+        Parameters
+        ----------
+        n_tiles: int
+            Number of tiles to process.
+        batch_size: int|str
+            Requested batch size or 'auto' (default: metadata batch size).
+        mem_budget: int
+            Memory budget for automatic batch sizing (MB).
+
+        Returns
+        ------
+        int
+            Batch size.
+        """
+        batch_size = batch_size if batch_size is not None else self.meta.batch_size
+        mem_budget = mem_budget if mem_budget is not None else defaults.batch_mem
+
+        if batch_size == 'auto':
+            tile_mem = self.meta.tile_size * self.meta.tile_size * defaults.px_bytes
+            batch_size = int(mem_budget * 1024 * 1024 // tile_mem)
+
+        return max(1, min(int(batch_size), max(n_tiles, 1)))
+
 
     def normalize_image(self, img, default=False):
         """
@@ -257,3 +731,29 @@ class Model:
                            self.meta.schema_name
         else:
             self.meta.id = get_fname(self.model_path)
+
+
+def inference_mode():
+    """
+    Returns inference mode context (falls back to no_grad for torch < 1.9).
+    """
+    if hasattr(torch, 'inference_mode'):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
+def unload_model(model_path=None):
+    """
+    Removes model(s) from the process-wide model cache.
+
+    Parameters
+    ----------
+    model_path: str
+        Path to PyLC model (default: unload all models).
+    """
+    path = os.path.realpath(model_path) if model_path else None
+    for key in [k for k in _registry if path is None or k[0] == path]:
+        del _registry[key]
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
@@ -9,6 +9,7 @@ It can use Modified Aligned Xception and ResNet as backbone.
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 
 class _ASPPModule(nn.Module):
@@ -27,6 +28,12 @@ class _ASPPModule(nn.Module):
 
         return self.relu(x)
 
+    def fuse_bn(self):
+        """Fold batch normalization into preceding convolution (eval mode)."""
+        self.atrous_conv = fuse_conv_bn_eval(self.atrous_conv, self.bn)
+        self.bn = nn.Identity()
+        return self
+
     def _init_weight(self):
         for m in self.modules():
             if isinstance(m, nn.Conv2d):
@@ -77,6 +84,16 @@ class ASPP(nn.Module):
 
         return self.dropout(x)
 
+    def fuse_bn(self):
+        """Fold batch normalization into preceding convolutions (eval mode)."""
+        for aspp in [self.aspp1, self.aspp2, self.aspp3, self.aspp4]:
+            aspp.fuse_bn()
+        pool, conv, bn, relu = self.global_avg_pool
+        self.global_avg_pool = nn.Sequential(pool, fuse_conv_bn_eval(conv, bn), relu)
+        self.conv1 = fuse_conv_bn_eval(self.conv1, self.bn1)
+        self.bn1 = nn.Identity()
+        return self
+
     def _init_weight(self):
         for m in self.modules():
             if isinstance(m, nn.Conv2d):
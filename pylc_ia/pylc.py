@@ -21,8 +21,9 @@ from pylc_ia.test import test_model
 
 def main(args):
     """
-    Main application handler
+    Main application handler. Returns image results (see test_model).
     """
     # Get parsed input arguments
     
-    test_model(args)
+    return test_model(args)
+
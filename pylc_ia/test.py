@@ -14,10 +14,15 @@ File: test.py
 
 import os
 import sys
-from qgis.PyQt.QtWidgets import QProgressDialog
-from qgis.PyQt.QtCore import Qt
+import time
+import queue
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
+import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
@@ -25,16 +30,31 @@ import utils.tools as utils
 from config import defaults, Parameters
 from utils.extract import Extractor
 from utils.evaluate import Evaluator
+from utils.manifest import Manifest
+from utils.result_cache import ResultCache
+from utils.profiler import profiler
+from utils.uniform import uniform_tiles
+from utils.control import Progress, ImageResult
 from models.model import Model
 
 def test_model(args):
     """
     Apply model to input image(s) to generate segmentation maps.
+    Runs without a user interface: progress is reported to the
+    args['progress'] callback (value, maximum, label) and the run stops
+    with CancelledError once args['cancel'] (CancelToken) is cancelled.
+    Errors are raised as PyLCError.
 
     Parameters
     ----------
     args: dict
         User-defined options.
+
+    Returns
+    -------
+    results: list
+        Image results (ImageResult), including images with up-to-date
+        or cached outputs.
     """
 
     # trained model path
@@ -43,53 +63,967 @@ def test_model(args):
     # load parameters
     params = Parameters(args)
 
+    # get test file(s) - returns list of filenames
+    files = utils.load_files(args['img'], ['.tif', '.tiff', '.jpg', '.jpeg', '.TIFF', '.JPEG', '.JPG', '.TIF'])
+
+    # streaming evaluation against ground-truth masks (optional)
+    # - saved masks are evaluated as images complete (including reused outputs)
+    evaluation = None
+    if args.get('mask'):
+        args = dict(args, mask_files=get_mask_files(args['mask'], files))
+        evaluation = Evaluator(params)
+
+    # directory batch mode: per-image outputs in output directory
+    # - images with up-to-date outputs are skipped
+    manifest = None
+    results = []
+    if args.get('output_dir'):
+        manifest = Manifest(args['output_dir'], model_path, get_settings(params, args), params.overwrite)
+        for img_file in [f for f in files if manifest.is_current(f, args['save_probs'], args.get('save_class_probs'))]:
+            manifest.skip(img_file)
+            files.remove(img_file)
+            img_args = get_args(img_file, args, manifest)
+            results += [ImageResult(img_file, get_outputs(img_args), cached=True,
+                                    metrics=evaluate_outputs(img_file, img_args, evaluation))]
+        if not files:
+            manifest.save()
+            manifest.print_summary()
+            print_evaluation(evaluation, args)
+            return results
+
+    # persistent result cache (opt-in)
+    # - outputs of previously classified images are restored from cache
+    result_cache = None
+    if params.result_cache:
+        settings = {k: v for k, v in get_settings(params, args).items() if not k.startswith('save_')}
+        result_cache = ResultCache(params.result_cache_dir, model_path, settings, params.result_cache_size)
+        for img_file in list(files):
+            start = time.perf_counter()
+            img_args = get_args(img_file, args, manifest)
+            if result_cache.restore(img_file, get_outputs(img_args)):
+                files.remove(img_file)
+                timing = {'total': time.perf_counter() - start}
+                if manifest is not None:
+                    manifest.update(img_file, img_args['mask_path'], img_args.get('probs_path'),
+                                    timing, img_args.get('class_probs_path'))
+                results += [ImageResult(img_file, get_outputs(img_args), timing, cached=True,
+                                        metrics=evaluate_outputs(img_file, img_args, evaluation))]
+
+    # stage-level profiling (opt-in)
+    if params.profile_report or params.profile_trace:
+        profiler.start(trace=bool(params.profile_trace))
+
+    # uniform tile short-circuit (opt-in)
+    if params.uniform_tiles:
+        uniform_tiles.start(params.uniform_std, params.uniform_bucket, params.uniform_check,
+                            params.uniform_cache_size)
+
+    try:
+        with profiler.torch_trace(params.profile_trace):
+            if files:
+                results += run_model(model_path, files, params, args, manifest, result_cache, evaluation)
+    finally:
+        if manifest is not None:
+            manifest.save()
+            manifest.print_summary()
+        if result_cache is not None:
+            result_cache.print_summary()
+        print_evaluation(evaluation, args)
+        if uniform_tiles.enabled:
+            uniform_tiles.print_report()
+            uniform_tiles.stop()
+        if profiler.enabled:
+            profiler.stop().print_report()
+            if params.profile_report:
+                print('{:30s} {}'.format('Profile report', profiler.save(params.profile_report, get_settings(params, args))))
+
+    return results
+
+
+def run_model(model_path, files, params, args, manifest=None, result_cache=None, evaluation=None):
+    """
+    Loads model and applies it to input images.
+
+    Parameters
+    ----------
+    model_path: str
+        Path to PyLC model.
+    files: list
+        Image file paths.
+    params: Parameters
+        Runtime parameters.
+    args: dict
+        User-defined options.
+    manifest: Manifest
+        Batch run manifest (directory batch mode).
+    result_cache: ResultCache
+        Persistent result cache.
+    evaluation: Evaluator
+        Streaming evaluation against ground-truth masks.
+
+    Returns
+    -------
+    results: list
+        Image results (ImageResult).
+    """
+
     # Load model for testing/evaluation
-    model = Model().load(model_path)
+    with profiler.stage('load_model'):
+        model = Model().load(model_path, jit=params.jit, cache_dir=params.cache_dir)
     model.print_settings()
     model.net.eval()
 
-    # get test file(s) - returns list of filenames
-    files = utils.load_files(args['img'], ['.tif', '.tiff', '.jpg', '.jpeg', '.TIFF', '.JPEG', '.JPG', '.TIF'])
     # initialize extractor, evaluator
     extractor = Extractor(model.meta)
     evaluator = Evaluator(model.meta)
 
+    # int8 quantized inference (opt-in), calibrated on input tiles
+    # - as many tiles again are held out for the agreement report
+    if params.quantize:
+        with profiler.stage('load_model'):
+            model.quantize(lambda: sample_tiles(extractor, files, 2 * params.n_calib, params.scale),
+                           get_calib_settings(files, params))
+
+    # optimized CPU inference (opt-in)
+    if params.fast_cpu:
+        with profiler.stage('load_model'):
+            model.optimize(params.n_threads)
+
+    # number of tiles per forward pass
+    batch_size = model.get_batch_size(params.tiles_per_image, params.batch_size, params.batch_mem)
+
+    # process pool batch mode (opt-in, CPU only)
+    if params.n_procs > 1 and len(files) > 1:
+        if model.device.type == 'cpu':
+            return test_pool(model, files, params, args, batch_size, manifest, result_cache, evaluation)
+        print('Process pool mode is only available for CPU inference (running sequentially).')
+
+    # pipelined batch mode (opt-in)
+    if params.pipeline and len(files) > 1 and not params.pyramid_scales:
+        return test_pipelined(model, files, params, args, batch_size, manifest, result_cache, evaluation)
+
+    results = []
     for img_file in files:
+        img_args = get_args(img_file, args, manifest)
+        timing, arrays = classify_image(
+            model, extractor, evaluator, img_file, img_args, params, batch_size, get_progress(args, img_file))
+        results += [record_outputs(img_file, img_args, timing, manifest, result_cache, evaluation, arrays)]
+    return results
+
+
+def classify_image(model, extractor, evaluator, img_file, args, params, batch_size, progress=None):
+    """
+    Applies model to input image and saves outputs.
+
+    Parameters
+    ----------
+    model: Model
+        Loaded PyLC model.
+    extractor: Extractor
+        Tile extractor.
+    evaluator: Evaluator
+        Evaluator.
+    img_file: str
+        Image file path.
+    args: dict
+        Output options.
+    params: Parameters
+        Runtime parameters.
+    batch_size: int
+        Number of tiles per forward pass.
+    progress: Progress
+        Progress reporting and cancellation (optional).
+
+    Returns
+    -------
+    timing: dict
+        Per-stage timings (s).
+    arrays: dict
+        Mask and probability arrays (if args['keep_arrays']).
+    """
+    start = time.perf_counter()
+    timing = {'inference': 0.}
+
+    # multi-scale inference (opt-in)
+    if params.pyramid_scales:
+        results, probs = predict_pyramid(
+            model, extractor, img_file, args, params, batch_size, timing, progress)
+
+    else:
+        # stream image tiles (image is resized and cropped to fit tile size)
+        tile_batches = get_tiles(
+            extractor.load(img_file, buffered=False, save_path=args.get('scaled_path')), params, batch_size)
+
+        # apply model to input tiles (lazily)
+        model_outputs = predict(model, tile_batches, extractor.get_meta(), progress, timing)
+
+        # reconstruct model outputs
+        results, probs = reconstruct(
+            model_outputs, extractor.get_meta(), params.recon_type, args.get('class_probs_path'),
+            params.mask_format == 'index')
+
+    # load results into evaluator
+    # - save full-sized predicted mask image to file
+    write_start = time.perf_counter()
+    save_outputs(evaluator.load(results, probs, extractor.get_meta()), args)
+    timing['write'] = time.perf_counter() - write_start
+    timing['total'] = time.perf_counter() - start
+    arrays = get_arrays(evaluator, args)
+
+    # Reset evaluator
+    evaluator.reset()
+
+    return timing, arrays
+
+
+def record_outputs(img_file, args, timing, manifest=None, result_cache=None, evaluation=None, arrays=None):
+    """
+    Records outputs of classified image in batch manifest and result cache,
+    and evaluates the saved mask against its ground-truth mask.
+
+    Parameters
+    ----------
+    img_file: str
+        Image file path.
+    args: dict
+        Output options.
+    timing: dict
+        Per-stage timings (s).
+    manifest: Manifest
+        Batch run manifest (directory batch mode).
+    result_cache: ResultCache
+        Persistent result cache.
+    evaluation: Evaluator
+        Streaming evaluation against ground-truth masks.
+    arrays: dict
+        Mask and probability arrays held by the result (optional).
+
+    Returns
+    -------
+    result: ImageResult
+        Image result.
+    """
+    if manifest is not None:
+        manifest.update(img_file, args['mask_path'], args.get('probs_path'), timing, args.get('class_probs_path'))
+    if result_cache is not None:
+        result_cache.store(img_file, get_outputs(args))
+    return ImageResult(img_file, get_outputs(args), timing, metrics=evaluate_outputs(img_file, args, evaluation),
+                       arrays=arrays)
+
+
+def get_arrays(evaluator, args):
+    """
+    Returns mask and probability arrays of loaded evaluator, if they
+    are kept in memory (args['keep_arrays']). Probabilities that are not
+    saved by the run (save_probs off) are written on ImageResult.save().
+
+    Parameters
+    ----------
+    evaluator: Evaluator
+        Evaluator loaded with model results.
+    args: dict
+        Output options.
+    """
+    if not args.get('keep_arrays'):
+        return None
+    return {'mask': evaluator.mask_pred, 'probs': evaluator.probs_pred}
+
+
+def evaluate_outputs(img_file, args, evaluation=None):
+    """
+    Evaluates saved mask of image against its ground-truth mask (if any).
+    Returns image metrics (see utils.evaluate.get_metrics).
+
+    Parameters
+    ----------
+    img_file: str
+        Image file path.
+    args: dict
+        Output options (see get_args).
+    evaluation: Evaluator
+        Streaming evaluation against ground-truth masks.
+    """
+    if evaluation is None or not args.get('mask_true_path'):
+        return None
+    return evaluation.evaluate(args['mask_true_path'], args['mask_path'], os.path.basename(img_file))
+
+
+def print_evaluation(evaluation, args):
+    """
+    Prints evaluation report (and saves it to the output directory in
+    directory batch mode).
+
+    Parameters
+    ----------
+    evaluation: Evaluator
+        Streaming evaluation against ground-truth masks.
+    args: dict
+        User-defined options.
+    """
+    if evaluation is None or not evaluation.metrics:
+        return
+    evaluation.print_report(per_image=not args.get('aggregate_metrics'))
+    if args.get('output_dir'):
+        print('{:30s} {}'.format('Evaluation report', evaluation.save(os.path.join(args['output_dir'], 'metrics.json'))))
+
+
+def get_mask_files(mask_path, files):
+    """
+    Returns ground-truth mask file of each image. A mask file is matched
+    to a single input image; in a directory, masks are matched by file
+    name (<stem>.png or <stem>_mask.png).
+
+    Parameters
+    ----------
+    mask_path: str
+        Path to ground-truth mask directory or file.
+    files: list
+        Image file paths.
+    """
+    masks = utils.load_files(mask_path, ['.png', '.tif', '.tiff', '.PNG', '.TIF', '.TIFF'])
+    if os.path.isfile(mask_path) and len(files) == 1:
+        return {files[0]: masks[0]}
+    stems = {os.path.splitext(os.path.basename(f))[0]: f for f in masks}
+    mask_files = {}
+    for img_file in files:
+        stem = os.path.splitext(os.path.basename(img_file))[0]
+        mask_file = stems.get(stem) or stems.get(stem + '_mask')
+        if mask_file is None:
+            print('Ground-truth mask not found (not evaluated):\n\t{}'.format(img_file))
+            continue
+        mask_files[img_file] = mask_file
+    return mask_files
+
+
+def test_pipelined(model, files, params, args, batch_size, manifest=None, result_cache=None, evaluation=None):
+    """
+    Pipelined batch mode: overlaps image decoding, inference and
+    reconstruction/output of consecutive images.
+        - images are decoded ahead on worker threads
+        - tiles are cut lazily and classified on the main thread
+        - model outputs are reconstructed and written on a writer thread
+    Queues between stages are bounded: at most n_prefetch decoded images
+    and n_prefetch images awaiting output are held in memory, and at most
+    n_prefetch batches of model outputs per image are queued for the
+    writer (inference waits on a slow writer).
+
+    Parameters
+    ----------
+    model: Model
+        Loaded PyLC model.
+    files: list
+        Image file paths.
+    params: Parameters
+        Runtime parameters.
+    args: dict
+        User-defined options.
+    batch_size: int
+        Number of tiles per forward pass.
+    manifest: Manifest
+        Batch run manifest (directory batch mode).
+    result_cache: ResultCache
+        Persistent result cache.
+    evaluation: Evaluator
+        Streaming evaluation against ground-truth masks.
+
+    Returns
+    -------
+    results: list
+        Image results (ImageResult).
+    """
+    n_prefetch = max(1, params.n_prefetch)
+    jobs = queue.Queue(maxsize=n_prefetch)
+    errors = []
+    results = []
+
+    def decode(img_file):
+        # each image is extracted with its own metadata
+        # - the first batch is cut here, so the image is decoded on the worker
+        #   thread; remaining tiles are cut lazily from the decoded image
+        extractor = Extractor(model.meta).load(img_file, buffered=False)
+        tile_batches = get_tiles(extractor, params, batch_size)
+        first = next(tile_batches, None)
+        if first is not None:
+            tile_batches = itertools.chain([first], tile_batches)
+        return tile_batches, extractor.get_meta()
+
+    def consume(outputs, state):
+        # model outputs of image (until end marker)
+        yield from iter(outputs.get, None)
+        state['consumed'] = True
+
+    def write():
+        evaluator = Evaluator(model.meta)
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            # outputs of an image whose inference failed or was cancelled are not saved
+            img_file, outputs, meta, timing, aborted = job
+            state = {'consumed': False}
+            try:
+                # consume model outputs as they are queued by the main thread
+                img_args = get_args(img_file, args, manifest)
+                mask, probs = reconstruct(
+                    consume(outputs, state), meta, params.recon_type, img_args.get('class_probs_path'),
+                    params.mask_format == 'index')
+                if not aborted.is_set():
+                    write_start = time.perf_counter()
+                    save_outputs(evaluator.load(mask, probs, meta), img_args)
+                    timing['write'] = time.perf_counter() - write_start
+                    timing['total'] = time.perf_counter() - timing.pop('start')
+                    results.append(record_outputs(
+                        img_file, img_args, timing, manifest, result_cache, evaluation, get_arrays(evaluator, img_args)))
+            except Exception as err:
+                errors.append(err)
+                # unblock inference of failed image (bounded output queue)
+                if not state['consumed']:
+                    for _ in iter(outputs.get, None):
+                        pass
+            evaluator.reset()
+
+    start = time.perf_counter()
+    infer_time = 0.
+    writer = threading.Thread(target=write, daemon=True)
+    writer.start()
+
+    with ThreadPoolExecutor(max_workers=n_prefetch) as pool:
+        pending = deque(pool.submit(decode, img_file) for img_file in files[:n_prefetch])
+        try:
+            for i in range(len(files)):
+                tile_batches, meta = pending.popleft().result()
+                if i + n_prefetch < len(files):
+                    pending.append(pool.submit(decode, files[i + n_prefetch]))
+
+                outputs = queue.Queue(maxsize=n_prefetch)
+                timing = {'start': time.perf_counter(), 'inference': 0.}
+                aborted = threading.Event()
+                jobs.put((files[i], outputs, meta, timing, aborted))
+                try:
+                    for logits in predict(model, tile_batches, meta, get_progress(args, files[i]), timing):
+                        outputs.put(logits)
+                except BaseException:
+                    aborted.set()
+                    raise
+                finally:
+                    outputs.put(None)
+                infer_time += timing['inference']
+
+                if errors:
+                    raise errors[0]
+        finally:
+            for future in pending:
+                future.cancel()
+            jobs.put(None)
+            writer.join()
+
+    if errors:
+        raise errors[0]
+
+    total_time = time.perf_counter() - start
+    hline = '-' * 40
+    print('\nPipelined Run')
+    print(hline)
+    print('{:30s} {}'.format('Images', len(files)))
+    print('{:30s} {:.2f}s'.format('Total time', total_time))
+    print('{:30s} {:.2f}s'.format('Time per image', total_time / len(files)))
+    print('{:30s} {:.2f}s ({:.0f}%)'.format('Inference time', infer_time, 100 * infer_time / total_time))
+    print(hline)
+
+    return results
+
+
+def test_pool(model, files, params, args, batch_size, manifest=None, result_cache=None, evaluation=None):
+    """
+    Process pool batch mode: images are classified in parallel by worker
+    processes, one image per worker at a time. The model is loaded once;
+    network weights are moved to shared memory and shared by all workers.
+    Each worker is limited to n_threads CPU threads (default: CPU count
+    divided by number of processes). Outputs are recorded in the manifest
+    and result cache as images complete.
+
+    Parameters
+    ----------
+    model: Model
+        Loaded PyLC model.
+    files: list
+        Image file paths.
+    params: Parameters
+        Runtime parameters.
+    args: dict
+        User-defined options.
+    batch_size: int
+        Number of tiles per forward pass.
+    manifest: Manifest
+        Batch run manifest (directory batch mode).
+    result_cache: ResultCache
+        Persistent result cache.
+    evaluation: Evaluator
+        Streaming evaluation against ground-truth masks.
+
+    Returns
+    -------
+    results: list
+        Image results (ImageResult).
+    """
+    n_procs = min(params.n_procs, len(files))
+    n_threads = params.n_threads or max(1, (os.cpu_count() or 1) // n_procs)
+
+    # share network weights (workers are forked where supported)
+    model.net.share_memory()
+    methods = torch.multiprocessing.get_all_start_methods()
+    ctx = torch.multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+
+    # progress callback and cancellation token stay in the main process
+    worker_args = {k: v for k, v in args.items() if k not in ['progress', 'cancel']}
+    jobs = [(img_file, get_args(img_file, worker_args, manifest)) for img_file in files]
+    worker_time = 0.
+    start = time.perf_counter()
+    results = []
+
+    # progress is reported per completed image
+    # - on cancellation, the pool is terminated
+    progress = get_progress(args, 'Images')
+    progress.update(0, len(files))
+    initargs = (model, params, batch_size, n_threads, profiler.enabled)
+    with ctx.Pool(n_procs, initializer=init_worker, initargs=initargs) as pool:
+        for i, (img_file, img_args, timing, arrays, stages, uniform) in enumerate(pool.imap_unordered(run_worker, jobs)):
+            results += [record_outputs(img_file, img_args, timing, manifest, result_cache, evaluation, arrays)]
+            profiler.merge(stages)
+            uniform_tiles.merge(uniform)
+            worker_time += timing['total']
+            progress.update(i + 1, len(files))
 
-        # extract image tiles (image is resized and cropped to fit tile size)
-        img_tiles = extractor.load(img_file).extract(
-            fit=True,
-            stride=params.tile_size // 2,
-            scale=params.scale
-        ).imgs
-
-        # apply model to input tiles
-        with torch.no_grad():
-            # get model outputs
-            model_outputs = []
-            
-            progressDlg = QProgressDialog("Running classification...","Cancel", 0, len(img_tiles))
-            progressDlg.setWindowModality(Qt.WindowModal)
-            progressDlg.setValue(0)
-            progressDlg.forceShow()
-            progressDlg.show()
-            
-            for i, tile in enumerate(img_tiles):
-                progressDlg.setValue(i)
-                logits = model.test(torch.Tensor(tile))
-                model_outputs += logits
-                model.iter += 1
-
-        # load results into evaluator
-        results, probs = utils.reconstruct(model_outputs, extractor.get_meta())
-        
-        # - save full-sized predicted mask image to file
-        evaluator.load(results, probs, extractor.get_meta()).save_image(args)
+    total_time = time.perf_counter() - start
+    hline = '-' * 40
+    print('\nProcess Pool Run')
+    print(hline)
+    print('{:30s} {}'.format('Images', len(files)))
+    print('{:30s} {} ({} threads each)'.format('Worker processes', n_procs, n_threads))
+    print('{:30s} {:.2f}s'.format('Total time', total_time))
+    print('{:30s} {:.2f}s'.format('Time per image', total_time / len(files)))
+    print('{:30s} {:.2f}s'.format('Worker time per image', worker_time / len(files)))
+    print('{:30s} {:.2f}'.format('Worker concurrency', worker_time / total_time))
+    print(hline)
 
+    return results
+
+
+# Process pool worker state (see init_worker)
+_worker = {}
+
+
+def init_worker(model, params, batch_size, n_threads, profile=False):
+    """
+    Initializes process pool worker: limits CPU threads and creates the
+    worker extractor and evaluator.
+
+    Parameters
+    ----------
+    model: Model
+        Loaded PyLC model (weights in shared memory).
+    params: Parameters
+        Runtime parameters.
+    batch_size: int
+        Number of tiles per forward pass.
+    n_threads: int
+        Number of CPU threads per worker.
+    profile: bool
+        Record stage costs (returned to the main process).
+    """
+    torch.set_num_threads(n_threads)
+    if profile:
+        profiler.start()
+    if params.uniform_tiles:
+        uniform_tiles.start(params.uniform_std, params.uniform_bucket, params.uniform_check,
+                            params.uniform_cache_size)
+    _worker.update({
+        'model': model,
+        'extractor': Extractor(model.meta),
+        'evaluator': Evaluator(model.meta),
+        'params': params,
+        'batch_size': batch_size
+    })
+
+
+def run_worker(job):
+    """
+    Process pool worker: classifies image and saves outputs.
+
+    Parameters
+    ----------
+    job: tuple
+        Image file path and output options.
+
+    Returns
+    -------
+    tuple
+        Image file path, output options, per-stage timings (s), output
+        arrays (if kept), profiler stage records and uniform tile statistics.
+    """
+    img_file, img_args = job
+    timing, arrays = classify_image(
+        _worker['model'], _worker['extractor'], _worker['evaluator'], img_file, img_args,
+        _worker['params'], _worker['batch_size'])
+    uniform = uniform_tiles.collect() if uniform_tiles.enabled else None
+    return img_file, img_args, timing, arrays, profiler.collect(), uniform
+
+
+def get_settings(params, args):
+    """
+    Returns run settings that determine model outputs.
+
+    Parameters
+    ----------
+    params: Parameters
+        Runtime parameters.
+    args: dict
+        User-defined options.
+    """
+    return {
+        'scale': params.scale,
+        'tile_size': params.tile_size,
+        'stride': params.tile_size // 2 if params.recon_type == 'stitch' else params.stride,
+        'recon_type': params.recon_type,
+        'quantize': params.quantize,
+        'mask_format': params.mask_format,
+        'uniform_tiles': [params.uniform_std, params.uniform_bucket] if params.uniform_tiles else None,
+        'pyramid_scales': list(params.pyramid_scales),
+        'save_probs': bool(args['save_probs']),
+        'save_class_probs': bool(args.get('save_class_probs'))
+    }
+
+
+def get_args(img_file, args, manifest=None):
+    """
+    Returns output options for image. Per-class probabilities (opt-in)
+    are written to <mask name>_classprobs.npy. In directory batch mode,
+    outputs are written to <stem>_mask.png, <stem>_probs.npy and
+    <stem>_classprobs.npy in the output directory.
+
+    Parameters
+    ----------
+    img_file: str
+        Image file path.
+    args: dict
+        User-defined options.
+    manifest: Manifest
+        Batch run manifest (directory batch mode).
+    """
+    if args.get('mask_files'):
+        args = dict(args, mask_true_path=args['mask_files'].get(img_file))
+    if manifest is None:
+        if not args.get('save_class_probs'):
+            return args
+        mask_name, ext = os.path.splitext(os.path.realpath(args['mask_path']))
+        return dict(args, class_probs_path=args.get('class_probs_path') or mask_name + '_classprobs.npy')
+    mask_file, probs_file, class_probs_file = manifest.get_outputs(img_file)
+    return dict(args, mask_path=mask_file, probs_path=probs_file if args['save_probs'] else None,
+                class_probs_path=class_probs_file if args.get('save_class_probs') else None, scaled_path=None)
+
+
+def get_outputs(args):
+    """
+    Returns output file paths of image, by output name ('mask', 'probs',
+    'class_probs', 'scaled').
+
+    Parameters
+    ----------
+    args: dict
+        Output options (see get_args).
+    """
+    mask_name, ext = os.path.splitext(os.path.realpath(args['mask_path']))
+    outputs = {'mask': args['mask_path']}
+    if args['save_probs']:
+        outputs['probs'] = args.get('probs_path') or mask_name + '.npy'
+    if args.get('class_probs_path'):
+        outputs['class_probs'] = args['class_probs_path']
+    if args.get('scaled_path'):
+        outputs['scaled'] = args['scaled_path']
+    return outputs
+
+
+def save_outputs(evaluator, args):
+    """
+    Saves predicted mask (and probabilities) to file.
+
+    Parameters
+    ----------
+    evaluator: Evaluator
+        Evaluator loaded with model results.
+    args: dict
+        Output options.
+    """
+    with profiler.stage('write'):
+        evaluator.save_image(args)
         if args['save_probs']:
             evaluator.save_probs(args)
 
-        # Reset evaluator
-        evaluator.reset()
 
+def get_tiles(extractor, params, batch_size, scale=None):
+    """
+    Streams batches of image tiles for loaded extractor image
+    (image is resized and cropped to fit tile size).
+
+    Parameters
+    ----------
+    extractor: Extractor
+        Tile extractor (image loaded).
+    params: Parameters
+        Runtime parameters.
+    batch_size: int
+        Number of tiles per batch.
+    scale: float
+        Image scaling factor (default: params.scale).
+    """
+    return extractor.stream(
+        fit=True,
+        stride=params.tile_size // 2 if params.recon_type == 'stitch' else params.stride,
+        scale=scale or params.scale,
+        batch_size=batch_size,
+        read_type=params.read_type,
+        window_mem=params.window_mem
+    )
+
+
+def reconstruct(model_outputs, meta, recon_type, class_probs_path=None, as_index=False):
+    """
+    Reconstructs model outputs into mask (colourized, or class index map)
+    and probabilities.
+
+    Parameters
+    ----------
+    model_outputs: iterable
+        Model output logits [NCHW].
+    meta: Parameters
+        Extraction metadata.
+    recon_type: str
+        Tile reconstruction engine: 'stitch', 'accumulate', 'stream'.
+    class_probs_path: str
+        Per-class probabilities output path (optional).
+    as_index: bool
+        Return class index map [HW] instead of colourized mask.
+    """
+    with profiler.stage('reconstruct'):
+        if recon_type == 'stream':
+            return utils.reconstruct_streamed(model_outputs, meta, class_probs_path, as_index)
+        elif recon_type == 'accumulate':
+            return utils.reconstruct_weighted(list(model_outputs), meta, class_probs_path, as_index)
+        return utils.reconstruct(list(model_outputs), meta, class_probs_path, as_index)
+
+
+def get_progress(args, label=''):
+    """
+    Returns classification progress reporter for the user-defined
+    progress callback and cancellation token (both optional).
+
+    Parameters
+    ----------
+    args: dict
+        User-defined options ('progress', 'cancel').
+    label: str
+        Progress label (e.g. image file).
+    """
+    return Progress(args.get('progress'), args.get('cancel'), label)
+
+
+def predict(model, tile_batches, meta, progress=None, timing=None):
+    """
+    Generator: apply model to batches of input tiles. Near-uniform
+    tiles are filled with cached predictions if the uniform tile
+    short-circuit is enabled (see utils.uniform).
+
+    Parameters
+    ----------
+    model: Model
+        Loaded PyLC model.
+    tile_batches: iterable
+        Batches of image tiles [NCHW] and their grid coordinates.
+    meta: Parameters
+        Extraction metadata (updated by the extractor).
+    progress: Progress
+        Progress reporting and cancellation (optional).
+    timing: dict
+        Accumulates inference time (s) under 'inference' (optional).
+
+    Yields
+    ------
+    torch.tensor
+        Model output logits [NCHW].
+    """
+    n_processed = 0
+    with torch.no_grad():
+        for img_tiles, coords in tile_batches:
+            if progress is not None:
+                progress.update(n_processed, meta.extract['n'])
+            start = time.perf_counter()
+            if uniform_tiles.enabled:
+                logits = uniform_tiles.predict(model, img_tiles)
+            else:
+                logits = model.test(torch.Tensor(img_tiles))
+            if timing is not None:
+                timing['inference'] += time.perf_counter() - start
+            model.iter += 1
+            n_processed += len(img_tiles)
+            yield from logits
+        if progress is not None:
+            progress.update(n_processed, meta.extract['n'])
+
+
+def predict_pyramid(model, extractor, img_file, args, params, batch_size, timing, progress=None):
+    """
+    Multi-scale inference. The image is decoded once and each pyramid
+    scale is resized from the decoded image, classified and reconstructed
+    into class probabilities. Probabilities are upsampled to the output
+    scale (params.scale) and averaged into one mask. Per-scale costs are
+    reported on completion.
+
+    Parameters
+    ----------
+    model: Model
+        Loaded PyLC model.
+    extractor: Extractor
+        Tile extractor.
+    img_file: str
+        Image file path.
+    args: dict
+        Output options.
+    params: Parameters
+        Runtime parameters.
+    batch_size: int
+        Number of tiles per batch.
+    timing: dict
+        Accumulates inference time (s) under 'inference'.
+    progress: Progress
+        Progress reporting and cancellation (optional).
+
+    Returns
+    -------
+    mask_reconstructed: np.array
+        Reconstructed mask image data.
+    probs_reconstructed: np.array
+        Probability of most probable class.
+    """
+    extractor.load(img_file, buffered=False, keep_decoded=True)
+
+    # output scale (saved for display if requested)
+    img, w_full, h_full, w_out, h_out = extractor.get_scaled(img_file, params.scale)
+    if args.get('scaled_path'):
+        utils.save_image(img, args['scaled_path'], extractor.meta.ch)
+    del img
 
+    fused = np.zeros((extractor.meta.n_classes, h_out, w_out), dtype=np.float32)
+    report = []
+    for scale in params.pyramid_scales:
+        start = time.perf_counter()
+        scale_timing = {'inference': 0.}
+
+        # classify scale and upsample class probabilities to output scale
+        tile_batches = get_tiles(extractor, params, batch_size, scale=scale)
+        model_outputs = predict(model, tile_batches, extractor.get_meta(), progress, scale_timing)
+        with profiler.stage('reconstruct'):
+            probs = utils.resize_probs(utils.reconstruct_probs(model_outputs, extractor.get_meta()), w_out, h_out)
+            fused += probs
+        meta = extractor.get_meta().extract
+        report += [{
+            'scale': scale,
+            'size': '{}x{}'.format(meta['w_scaled'], meta['h_scaled']),
+            'tiles': meta['n'],
+            'classes': np.argmax(probs, axis=0).astype(np.uint8),
+            'inference': scale_timing['inference'],
+            'time': time.perf_counter() - start
+        }]
+        timing['inference'] += scale_timing['inference']
+        del probs
+
+    extractor.reset()
+    fused /= len(params.pyramid_scales)
+
+    if args.get('class_probs_path'):
+        with profiler.stage('write'):
+            utils.save_class_probs(args['class_probs_path'], fused)
+
+    class_map = np.argmax(fused, axis=0).astype(np.uint8)
+    mask_reconstructed = class_map if params.mask_format == 'index' else utils.colourize(
+        class_map[np.newaxis], model.meta.n_classes, palette=model.meta.palette_rgb)[0]
+    probs_reconstructed = np.max(fused, axis=0).astype('float16')
+
+    print_pyramid(report, class_map)
+
+    return mask_reconstructed, probs_reconstructed
+
+
+def print_pyramid(report, class_map):
+    """
+    Prints per-scale costs of multi-scale inference, with agreement of
+    each scale with the fused mask.
+
+    Parameters
+    ----------
+    report: list
+        Per-scale results.
+    class_map: np.array
+        Fused class index map [HW].
+    """
+    hline = '-' * 72
+    print('\nMulti-scale Inference')
+    print(hline)
+    print('{:>8s} {:>12s} {:>8s} {:>14s} {:>12s} {:>12s}'.format(
+        'Scale', 'Size', 'Tiles', 'Inference (s)', 'Total (s)', 'Agreement'))
+    for r in report:
+        print('{:>8} {:>12s} {:>8d} {:>14.2f} {:>12.2f} {:>11.1f}%'.format(
+            r['scale'], r['size'], r['tiles'], r['inference'], r['time'], 100 * np.mean(r['classes'] == class_map)))
+    print(hline)
+
+
+def get_calib_settings(files, params):
+    """
+    Returns quantization calibration settings (keys quantized network).
+    At most one image per sampled tile is read (see sample_tiles).
+
+    Parameters
+    ----------
+    files: list
+        Image file paths.
+    params: Parameters
+        Runtime parameters.
+    """
+    return {
+        'n_calib': params.n_calib,
+        'scale': params.scale,
+        'tile_size': params.tile_size,
+        'images': [utils.file_hash(f) for f in files[:2 * params.n_calib]]
+    }
+
+
+def sample_tiles(extractor, files, n_tiles, scale=None):
+    """
+    Samples non-overlapping tiles evenly from input image(s)
+    (e.g. for quantization calibration).
+
+    Parameters
+    ----------
+    extractor: Extractor
+        Tile extractor.
+    files: list
+        Image file paths.
+    n_tiles: int
+        Number of tiles to sample.
+    scale: float
+        Image scaling factor.
+
+    Returns
+    ------
+    np.array
+        Sampled tiles [NCHW].
+    """
+    n_per_file = -(-n_tiles // max(len(files), 1))
+    samples = []
+    for img_file in files:
+        tiles = np.concatenate([img_tiles for img_tiles, _ in extractor.load(img_file, buffered=False).stream(
+            fit=True, stride=extractor.meta.tile_size, scale=scale, batch_size=n_tiles)])
+        idx = np.unique(np.linspace(0, len(tiles) - 1, min(n_per_file, len(tiles))).astype(int))
+        samples += [tiles[idx]]
+        if sum(len(s) for s in samples) >= n_tiles:
+            break
+    return np.concatenate(samples)[:n_tiles]
@@ -0,0 +1,231 @@
+"""
+(c) 2020 Spencer Rose, MIT Licence
+Python Landscape Classification Tool (PyLC)
+ Reference: An evaluation of deep learning semantic segmentation
+ for land cover classification of oblique ground-based photography,
+ MSc. Thesis 2020.
+ <http://hdl.handle.net/1828/12156>
+Spencer Rose <spencerrose@uvic.ca>, June 2020
+University of Victoria
+
+Module: Benchmarks
+File: benchmark.py
+"""
+import os, sys
+import time
+import queue
+import multiprocessing
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from config import Parameters
+from utils import tools as utils
+from utils.profiler import peak_rss
+
+
+def synthetic_tiles(h, w, n_classes, tile_size, stride, seed=0):
+    """
+    Generates random tile logits and reconstruction metadata
+    for an image of the given (fitted) dimensions.
+
+    Parameters
+    ------
+    h: int
+        Image height (px).
+    w: int
+        Image width (px).
+    n_classes: int
+        Number of classes.
+    tile_size: int
+        Tile dimension.
+    stride: int
+        Stride of tile extraction.
+    seed: int
+        Random seed.
+
+    Returns
+    ------
+    logits: list
+        Tile logits [NCHW].
+    meta: Parameters
+        Reconstruction metadata.
+    """
+    meta = Parameters({'tile_size': tile_size, 'stride': stride})
+    n_rows = (h - tile_size) // stride + 1
+    n_cols = (w - tile_size) // stride + 1
+    meta.extract = {
+        'fid': 'synthetic', 'n': n_rows * n_cols,
+        'w_full': w, 'h_full': h, 'w_scaled': w, 'h_scaled': h,
+        'w_fitted': w, 'h_fitted': h, 'offset': 0
+    }
+    rng = np.random.default_rng(seed)
+    logits = rng.normal(0., 3., (n_rows * n_cols, n_classes, tile_size, tile_size)).astype(np.float32)
+    return [torch.as_tensor(logits)], meta
+
+
+def _run_reconstruct(engine, h, w, n_classes, tile_size, stride, results):
+    """
+    [Private] Times a reconstruction engine and measures its peak memory.
+    Runs in a child process so that peak RSS is not shared between engines.
+    """
+    logits, meta = synthetic_tiles(h, w, n_classes, tile_size, stride)
+    rss_start = peak_rss()
+    start = time.perf_counter()
+    if engine == 'stream':
+        mask, probs = utils.reconstruct_streamed(torch.split(logits[0], 8), meta)
+    elif engine == 'accumulate':
+        mask, probs = utils.reconstruct_weighted(logits, meta)
+    else:
+        mask, probs = utils.reconstruct(logits, meta)
+    results.put({
+        'engine': engine,
+        'time': time.perf_counter() - start,
+        'peak_mb': peak_rss() - rss_start,
+        'mask': mask.astype(np.uint8)
+    })
+
+
+def _get_result(engine, proc, results):
+    """
+    [Private] Waits for the result of a benchmark process. Returns a
+    failure record if the process exits without a result (e.g. killed
+    when out of memory).
+    """
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if not proc.is_alive():
+                break
+    # result may be flushed as the process exits
+    try:
+        return results.get(timeout=1)
+    except queue.Empty:
+        proc.join()
+        return {'engine': engine, 'exitcode': proc.exitcode}
+
+
+def benchmark_reconstruct(h=1280, w=1792, n_classes=9, tile_size=512, stride=256):
+    """
+    Compares reconstruction engines (stitch, accumulate, stream) for speed and
+    peak memory on synthetic logits. Prints results to console.
+
+    Parameters
+    ------
+    h: int
+        Image height (px).
+    w: int
+        Image width (px).
+    n_classes: int
+        Number of classes.
+    tile_size: int
+        Tile dimension.
+    stride: int
+        Stride of tile extraction.
+
+    Returns
+    ------
+    list
+        Benchmark results per engine (engines whose process failed,
+        e.g. out of memory, are reported with their exit code).
+    """
+    ctx = multiprocessing.get_context()
+    report = []
+    for engine in ['stitch', 'accumulate', 'stream']:
+        # stitching requires half-tile stride
+        engine_stride = tile_size // 2 if engine == 'stitch' else stride
+        results = ctx.Queue()
+        proc = ctx.Process(target=_run_reconstruct,
+                           args=(engine, h, w, n_classes, tile_size, engine_stride, results))
+        proc.start()
+        report.append(_get_result(engine, proc, results))
+        proc.join()
+
+    hline = '-' * 40
+    print('\nReconstruction Benchmark')
+    print(hline)
+    print('{:30s} {}px x {}px'.format('Image (WxH)', w, h))
+    print('{:30s} {}'.format('Classes', n_classes))
+    print('{:30s} {}px / {}px'.format('Tile size / stride', tile_size, stride))
+    for result in report:
+        if 'mask' not in result:
+            print('{:30s} failed (exit code {})'.format(result['engine'], result['exitcode']))
+            continue
+        # mask agreement with current (stitch) implementation
+        if 'mask' in report[0]:
+            agreement = '{:.2f}%'.format(100 * np.mean(np.all(report[0]['mask'] == result['mask'], axis=-1)))
+        else:
+            agreement = 'n/a'
+        print('{:30s} {:.3f}s  {:.1f}MB peak  {} agreement'.format(
+            result['engine'], result['time'], result['peak_mb'], agreement))
+    print(hline)
+
+    return report
+
+
+def benchmark_inference(model_path, n_tiles=16, batch_size=4, n_threads=None, seed=0):
+    """
+    Compares default and optimized (fast CPU) model inference for
+    throughput and output agreement on synthetic tiles. Prints
+    results to console.
+
+    Parameters
+    ------
+    model_path: str
+        Path to PyLC model.
+    n_tiles: int
+        Number of tiles.
+    batch_size: int
+        Tiles per forward pass.
+    n_threads: int
+        Number of CPU threads for optimized inference.
+    seed: int
+        Random seed.
+
+    Returns
+    ------
+    dict
+        Benchmark results.
+    """
+    from models.model import Model
+
+    model = Model().load(model_path)
+    ts = model.meta.tile_size
+    rng = np.random.default_rng(seed)
+    tiles = torch.as_tensor(rng.integers(0, 256, (n_tiles, model.meta.ch, ts, ts)).astype(np.float32))
+
+    def _run():
+        start = time.perf_counter()
+        logits = torch.cat([model.test(batch)[0] for batch in torch.split(tiles, batch_size)])
+        return n_tiles / (time.perf_counter() - start), logits
+
+    # warm up and time default inference
+    model.test(tiles[:1])
+    default_rate, default_logits = _run()
+
+    # warm up and time optimized inference
+    model.optimize(n_threads)
+    model.test(tiles[:1])
+    fast_rate, fast_logits = _run()
+
+    agreement = torch.mean((default_logits.argmax(1) == fast_logits.argmax(1)).float()).item()
+    max_diff = (torch.max(torch.abs(default_logits - fast_logits)) / torch.max(torch.abs(default_logits))).item()
+
+    hline = '-' * 40
+    print('\nInference Benchmark')
+    print(hline)
+    print('{:30s} {} x {}px'.format('Tiles', n_tiles, ts))
+    print('{:30s} {}'.format('Batch size', batch_size))
+    print('{:30s} {:.2f} tiles/s'.format('default', default_rate))
+    print('{:30s} {:.2f} tiles/s'.format('fast', fast_rate))
+    print('{:30s} {:.2f}x'.format('Speedup', fast_rate / default_rate))
+    print('{:30s} {:.2f}%'.format('Class agreement', 100 * agreement))
+    print('{:30s} {:.2e}'.format('Max logit difference (rel.)', max_diff))
+    print(hline)
+
+    return {'default': default_rate, 'fast': fast_rate, 'agreement': agreement, 'max_diff': max_diff}
+
+
+if __name__ == "__main__":
+    benchmark_reconstruct()
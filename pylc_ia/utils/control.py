@@ -0,0 +1,228 @@
+"""
+(c) 2020 Spencer Rose, MIT Licence
+Python Landscape Classification Tool (PyLC)
+ Reference: An evaluation of deep learning semantic segmentation
+ for land cover classification of oblique ground-based photography,
+ MSc. Thesis 2020.
+ <http://hdl.handle.net/1828/12156>
+Spencer Rose <spencerrose@uvic.ca>, June 2020
+University of Victoria
+
+Module: Run Control (errors, progress, cancellation, results)
+File: control.py
+"""
+import os
+import shutil
+import threading
+import numpy as np
+import cv2
+
+
+class PyLCError(Exception):
+    """
+    PyLC application error (e.g. invalid input image or settings).
+    """
+
+
+class CancelledError(PyLCError):
+    """
+    Run cancelled by user (see CancelToken).
+    """
+
+
+class CancelToken:
+    """
+    Cancellation token. Cancelling is thread-safe; the running
+    classification stops with CancelledError at the next tile batch
+    or image.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        """
+        Requests cancellation of the run.
+        """
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        """
+        Cancellation was requested.
+        """
+        return self.event.is_set()
+
+    def check(self):
+        """
+        Raises CancelledError if cancellation was requested.
+        """
+        if self.cancelled:
+            raise CancelledError('Classification cancelled.')
+
+
+class Progress:
+    """
+    Reports classification progress to a callback and checks for
+    cancellation on each update.
+
+    Parameters
+    ------
+    callback: callable
+        Progress callback: callback(value, maximum, label) (optional).
+    cancel: CancelToken
+        Cancellation token (optional).
+    label: str
+        Progress label (e.g. image file).
+    """
+
+    def __init__(self, callback=None, cancel=None, label=''):
+        self.callback = callback
+        self.cancel = cancel
+        self.label = label
+
+    def update(self, value, maximum):
+        """
+        Reports progress.
+
+        Parameters
+        ------
+        value: int
+            Number of completed units (e.g. tiles).
+        maximum: int
+            Total number of units.
+        """
+        if self.callback is not None:
+            self.callback(value, maximum, self.label)
+        self.check()
+
+    def check(self):
+        """
+        Raises CancelledError if cancellation was requested.
+        """
+        if self.cancel is not None:
+            self.cancel.check()
+
+
+class ImageResult:
+    """
+    Classification result of an input image. Holds output file paths and
+    (optionally) the mask and probability arrays. Outputs are persisted
+    to user-selected paths with save(): output files are hard-linked
+    (copied across file systems) rather than decoded and re-encoded, and
+    outputs held only in memory are written once.
+
+    Parameters
+    ------
+    img_file: str
+        Image file path.
+    outputs: dict
+        Output file paths, by output name ('mask', 'probs', 'class_probs', 'scaled').
+    timing: dict
+        Per-stage timings (s).
+    cached: bool
+        Outputs not recomputed (restored from the result cache or up to date
+        in the output directory).
+    metrics: dict
+        Evaluation metrics against ground-truth mask (if evaluated).
+    arrays: dict
+        Output arrays held in memory ('mask' [HW3] RGB or [HW] class index, 'probs' [HW]).
+    """
+
+    def __init__(self, img_file, outputs, timing=None, cached=False, metrics=None, arrays=None):
+        self.img_file = img_file
+        self.mask_path = outputs.get('mask')
+        self.probs_path = outputs.get('probs')
+        self.class_probs_path = outputs.get('class_probs')
+        self.scaled_path = outputs.get('scaled')
+        self.timing = timing or {}
+        self.cached = cached
+        self.metrics = metrics
+        self.arrays = arrays or {}
+
+    @property
+    def mask(self):
+        """
+        Predicted mask array (RGB or class index), if held in memory.
+        """
+        return self.arrays.get('mask')
+
+    @property
+    def probs(self):
+        """
+        Probability of most probable class, if held in memory.
+        """
+        return self.arrays.get('probs')
+
+    def save(self, mask_path=None, probs_path=None, class_probs_path=None):
+        """
+        Persists outputs to the given paths. Output paths of the result
+        are updated to the saved files.
+
+        Parameters
+        ------
+        mask_path: str
+            Mask file path (PNG).
+        probs_path: str
+            Probabilities file path (.npy).
+        class_probs_path: str
+            Per-class probabilities file path (.npy).
+        """
+        for name, path in [('mask', mask_path), ('probs', probs_path), ('class_probs', class_probs_path)]:
+            if path:
+                self.persist(name, path)
+        return self
+
+    def persist(self, name, path):
+        """
+        Persists output to path: links (or copies) the output file, or
+        writes the output array if it has not been written.
+
+        Parameters
+        ------
+        name: str
+            Output name ('mask', 'probs', 'class_probs').
+        path: str
+            Output file path.
+        """
+        src = getattr(self, name + '_path')
+        if src and os.path.isfile(src):
+            link_file(src, path)
+        elif name == 'mask' and self.mask is not None and self.mask.ndim == 2:
+            from utils.tools import save_class_raster  # (tools imports control)
+            save_class_raster(path, self.mask)
+        elif name == 'mask' and self.mask is not None:
+            cv2.imwrite(path, cv2.cvtColor(self.mask, cv2.COLOR_RGB2BGR))
+        elif name == 'probs' and self.probs is not None:
+            np.save(path, self.probs)
+        else:
+            raise PyLCError('Output not available ({}): {}'.format(name, self.img_file))
+        setattr(self, name + '_path', path)
+        return path
+
+    def __repr__(self):
+        return 'ImageResult({!r}, mask={!r}, cached={})'.format(self.img_file, self.mask_path, self.cached)
+
+
+def link_file(src, dst):
+    """
+    Hard-links file to destination path, replacing an existing file.
+    Falls back to copying where links are not supported (e.g. across
+    file systems).
+
+    Parameters
+    ------
+    src: str
+        Source file path.
+    dst: str
+        Destination file path.
+    """
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return dst
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return dst
@@ -14,14 +14,16 @@ File: evaluate.py
 
 
 import os, sys
+import json
+import math
 import numpy as np
 import cv2
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from config import defaults, Parameters
-
-from interface_tools import errorMessage
+from utils.control import PyLCError
+from utils import tools as utils
 
 class Evaluator:
     """
@@ -45,19 +47,19 @@ class Evaluator:
         self.probs_pred = None
         self.results = []
 
-        # data buffers
-        self.y_true = None
-        self.y_pred = None
-        self.labels = []
+        # class schema (kept across images)
+        self.n_classes = self.meta.n_classes
+        self.palette = self.meta.palette_rgb
+        self.labels = self.meta.class_labels
 
-        # multi-image data buffers for aggregate evaluation
-        self.aggregate = False
-        self.y_true_aggregate = []
-        self.y_pred_aggregate = []
+        # streaming evaluation: confusion matrices are accumulated over
+        # evaluated images (pixel arrays are not kept)
+        self.conf_aggregate = np.zeros((self.n_classes, self.n_classes), dtype=np.int64)
+        self.metrics = []
 
         # Make output and mask directories for results
         self.model_path = None
-        self.output_dir = os.path.join(defaults.output_dir, self.meta.id)
+        self.output_dir = os.path.join(defaults.output_dir, self.meta.id) if self.meta.id else defaults.output_dir
 
     def load(self, mask_pred, probs_pred, meta, mask_true_path=None, scale=None):
         """
@@ -103,8 +105,142 @@ class Evaluator:
         self.probs_pred = None
         self.results = []
         self.meta = {}
-        self.y_true = None
-        self.y_pred = None
+
+    def evaluate(self, mask_true_path, mask_pred_path=None, fid=None):
+        """
+        Evaluates predicted mask (loaded, or read from file) against
+        ground-truth mask. Both masks are decoded once to class indices;
+        the ground-truth mask is resized (nearest neighbour) to the
+        predicted mask size. Only the confusion matrix is kept.
+
+        Parameters
+        ------
+        mask_true_path: str
+            Ground-truth mask file path (RGB, schema palette).
+        mask_pred_path: str
+            Predicted mask file path (default: loaded predicted mask).
+        fid: str
+            Image identifier (default: predicted mask file name).
+
+        Returns
+        ------
+        dict
+            Image metrics (see get_metrics).
+        """
+        if mask_pred_path is not None:
+            y_pred = utils.get_mask(mask_pred_path, self.palette)[0]
+            fid = fid or os.path.basename(mask_pred_path)
+        elif self.mask_pred is not None and self.mask_pred.ndim == 2:
+            y_pred = self.mask_pred
+            fid = fid or self.fid
+        elif self.mask_pred is not None:
+            y_pred = utils.decode_rgb(self.mask_pred, self.palette)[0]
+            fid = fid or self.fid
+        else:
+            raise PyLCError("Mask has not been reconstructed. Evaluation cancelled.")
+
+        h, w = y_pred.shape
+        y_true = utils.get_mask(mask_true_path, self.palette)[0]
+        if y_true.shape != (h, w):
+            y_true = cv2.resize(y_true, (w, h), interpolation=cv2.INTER_NEAREST)
+
+        return self.add(confusion_matrix(y_true, y_pred, self.n_classes), fid)
+
+    def add(self, conf, fid=None):
+        """
+        Adds image confusion matrix to the aggregate (e.g. evaluated
+        by a worker process) and returns the image metrics.
+
+        Parameters
+        ------
+        conf: np.array
+            Image confusion matrix.
+        fid: str
+            Image identifier.
+        """
+        self.conf_aggregate += conf
+        metrics = dict(get_metrics(conf, self.labels), fid=fid)
+        self.metrics += [metrics]
+        return metrics
+
+    def get_aggregate(self):
+        """
+        Returns aggregate metrics of evaluated images.
+        """
+        return dict(get_metrics(self.conf_aggregate, self.labels), fid='aggregate', n_images=len(self.metrics))
+
+    def print_metrics(self, metrics, title='Evaluation'):
+        """
+        Prints per-class IoU and F1, mean IoU, mean F1 and pixel accuracy.
+
+        Parameters
+        ------
+        metrics: dict
+            Evaluation metrics (see get_metrics).
+        title: str
+            Report title.
+        """
+        hline = '-' * 40
+        print('\n{} ({})'.format(title, metrics['fid']))
+        print(hline)
+        print('{:30s} {:>8s} {:>8s}'.format('Class', 'IoU', 'F1'))
+        for label in self.labels:
+            iou, f1 = metrics['iou'][label], metrics['f1'][label]
+            print('   - {:25s} {:>8s} {:>8s}'.format(
+                label, 'n/a' if np.isnan(iou) else '{:.4f}'.format(iou), 'n/a' if np.isnan(f1) else '{:.4f}'.format(f1)))
+        print('{:30s} {:.4f}'.format('Mean IoU', metrics['miou']))
+        print('{:30s} {:.4f}'.format('Mean F1', metrics['mf1']))
+        print('{:30s} {:.2f}%'.format('Pixel accuracy', 100 * metrics['accuracy']))
+        print(hline)
+
+    def print_report(self, per_image=True):
+        """
+        Prints per-image metrics summary and aggregate metrics.
+
+        Parameters
+        ------
+        per_image: bool
+            Include per-image summary.
+        """
+        if not per_image:
+            self.print_metrics(self.get_aggregate(), 'Aggregate Evaluation')
+            return
+        hline = '-' * 72
+        print('\nEvaluation Summary')
+        print(hline)
+        print('{:36s} {:>10s} {:>10s} {:>12s}'.format('Image', 'Mean IoU', 'Mean F1', 'Accuracy'))
+        for m in self.metrics:
+            print('{:36s} {:>10.4f} {:>10.4f} {:>11.2f}%'.format(
+                str(m['fid'])[:36], m['miou'], m['mf1'], 100 * m['accuracy']))
+        print(hline)
+        self.print_metrics(self.get_aggregate(), 'Aggregate Evaluation')
+
+    def save(self, path):
+        """
+        Writes per-image and aggregate metrics (with confusion matrices)
+        to JSON file. Undefined (NaN) metrics are written as null.
+
+        Parameters
+        ------
+        path: str
+            Report file path.
+        """
+        def nan_to_none(value):
+            if isinstance(value, dict):
+                return {k: nan_to_none(v) for k, v in value.items()}
+            if isinstance(value, float) and math.isnan(value):
+                return None
+            return value
+
+        def serialize(metrics):
+            return nan_to_none(dict(metrics, conf=metrics['conf'].tolist()))
+        with open(path, 'w') as f:
+            json.dump({
+                'labels': self.labels,
+                'aggregate': serialize(self.get_aggregate()),
+                'images': [serialize(m) for m in self.metrics]
+            }, f, indent=2, allow_nan=False)
+        return path
 
     def save_image(self, args):
         """
@@ -112,7 +248,8 @@ class Evaluator:
         Output mask image saved to file (RGB -> BGR conversion)
         Note that the default color format in OpenCV is often
         referred to as RGB but it is actually BGR (the bytes are
-        reversed).
+        reversed). Class index maps are saved as single-band PNG
+        with the schema palette as colour table.
 
         Returns
         -------
@@ -124,7 +261,13 @@ class Evaluator:
         mask_file = args["mask_path"]
 
         if self.mask_pred is None:
-            errorMessage("Mask has not been reconstructed. Image save cancelled.")
+            raise PyLCError("Mask has not been reconstructed. Image save cancelled.")
+
+        # class index map: single-band PNG with colour table
+        if self.mask_pred.ndim == 2:
+            if os.path.splitext(mask_file)[1].lower() != '.png':
+                raise PyLCError("Class index masks are saved as PNG:\n\t{}".format(mask_file))
+            return utils.save_class_raster(mask_file, self.mask_pred, self.meta.palette_rgb)
 
             # Reconstruct seg-mask from predicted tiles and write to file
         cv2.imwrite(mask_file, cv2.cvtColor(self.mask_pred, cv2.COLOR_RGB2BGR))
@@ -142,11 +285,106 @@ class Evaluator:
         
         mask_file = args["mask_path"]
         mask_name, ext = os.path.splitext(os.path.realpath(mask_file))
-        probs_file = os.path.join(mask_name + '.npy')
+        probs_file = args.get("probs_path") or os.path.join(mask_name + '.npy')
 
         if self.probs_pred is None:
-            errorMessage("Probabilities have not been reconstructed. Image save cancelled.")
-            return
+            raise PyLCError("Probabilities have not been reconstructed. Image save cancelled.")
 
         np.save(probs_file, self.probs_pred)
         return probs_file
+
+
+def confusion_matrix(y_true, y_pred, n_classes):
+    """
+    Computes confusion matrix of class index arrays.
+
+    Parameters
+    ------
+    y_true: np.array
+        Reference class indices.
+    y_pred: np.array
+        Predicted class indices.
+    n_classes: int
+        Number of classes.
+
+    Returns
+    ------
+    np.array
+        Confusion matrix [n_classes x n_classes] (rows: reference, columns: predicted).
+    """
+    idx = n_classes * np.asarray(y_true, dtype=np.int64).ravel() + np.asarray(y_pred, dtype=np.int64).ravel()
+    return np.bincount(idx, minlength=n_classes ** 2).reshape(n_classes, n_classes)
+
+
+def get_iou(conf):
+    """
+    Computes per-class intersection-over-union from confusion matrix.
+    Classes absent from both reference and prediction are NaN.
+
+    Parameters
+    ------
+    conf: np.array
+        Confusion matrix.
+
+    Returns
+    ------
+    np.array
+        Per-class IoU.
+    """
+    tp = np.diag(conf).astype(np.float64)
+    union = conf.sum(axis=0) + conf.sum(axis=1) - tp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, tp / union, np.nan)
+
+
+def get_f1(conf):
+    """
+    Computes per-class F1 score (Dice coefficient) from confusion matrix.
+    Classes absent from both reference and prediction are NaN.
+
+    Parameters
+    ------
+    conf: np.array
+        Confusion matrix.
+
+    Returns
+    ------
+    np.array
+        Per-class F1 score.
+    """
+    tp = np.diag(conf).astype(np.float64)
+    total = conf.sum(axis=0) + conf.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, 2 * tp / total, np.nan)
+
+
+def get_metrics(conf, labels):
+    """
+    Computes evaluation metrics from confusion matrix: per-class IoU
+    and F1, their means over classes present in reference or prediction,
+    and pixel accuracy.
+
+    Parameters
+    ------
+    conf: np.array
+        Confusion matrix (rows: reference, columns: predicted).
+    labels: list
+        Class labels.
+
+    Returns
+    ------
+    dict
+        Evaluation metrics (conf, iou, miou, f1, mf1, accuracy, n_pixels).
+    """
+    iou = get_iou(conf)
+    f1 = get_f1(conf)
+    present = ~np.isnan(iou)
+    return {
+        'conf': conf,
+        'iou': {label: float(v) for label, v in zip(labels, iou)},
+        'miou': float(np.mean(iou[present])) if present.any() else float('nan'),
+        'f1': {label: float(v) for label, v in zip(labels, f1)},
+        'mf1': float(np.mean(f1[present])) if present.any() else float('nan'),
+        'accuracy': float(np.trace(conf) / max(conf.sum(), 1)),
+        'n_pixels': int(conf.sum())
+    }
@@ -21,8 +21,8 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from config import Parameters, defaults
 from utils import tools as utils
-
-from interface_tools import errorMessage
+from utils.profiler import profiler
+from utils.control import PyLCError
 
 class Extractor(object):
     """
@@ -42,6 +42,7 @@ class Extractor(object):
         # initialize image/mask arrays
         self.img_path = None
         self.mask_path = None
+        self.save_path = None
         self.files = None
         self.n_files = 0
         self.img_idx = 0
@@ -53,11 +54,16 @@ class Extractor(object):
 
         # extraction parameters
         self.fit = False
+        self.read_type = 'full'
+
+        # decoded image (reused across scales)
+        self.keep_decoded = False
+        self.decoded = None
 
         # generate unique extraction ID
         self.meta.id = '_db_pylc_' + self.meta.ch_label + '_' + str(int(time.time()))
 
-    def load(self, img_path, mask_path=None):
+    def load(self, img_path, mask_path=None, buffered=True, save_path=None, keep_decoded=False):
         """
         Load image/masks into extractor for processing.
 
@@ -67,6 +73,13 @@ class Extractor(object):
             Image file/directory path.
         mask_path: str
             Mask file/directory path (Optional).
+        buffered: bool
+            Preallocate tile buffers (not required for streaming).
+        save_path: str
+            Save loaded (scaled) image to file (Optional).
+        keep_decoded: bool
+            Keep decoded image in memory, so that extraction at further
+            scales resizes it rather than decoding the file again.
 
         Returns
         ------
@@ -77,14 +90,19 @@ class Extractor(object):
         self.reset()
         self.img_path = img_path
         self.mask_path = mask_path
+        self.save_path = save_path
+        self.keep_decoded = keep_decoded
 
         # collate image/mask file paths
         self.files = utils.load_files(img_path, ['.tif', '.tiff', '.jpg', '.jpeg', '.TIFF', '.JPEG', '.JPG', '.TIF'])
         self.n_files = len(self.files)
 
         if self.n_files == 0:
-            errorMessage("File list is empty. Extraction stopped.")
-            return
+            raise PyLCError("File list is empty. Extraction stopped.")
+
+        # tiles are generated lazily by stream()
+        if not buffered:
+            return self
 
         # create image tile buffer
         self.imgs = np.empty(
@@ -144,41 +162,20 @@ class Extractor(object):
                     img_path = fpair
                     mask_path = None
 
-                # load image as numpy array (scaling optional)
-                img, w_full, h_full, w_scaled, h_scaled = utils.get_image(
-                    img_path,
-                    self.meta.ch,
-                    scale=scale,
-                    interpolate=cv2.INTER_AREA
-                )
-
-                # adjust image size to fit tile size (optional)
-                img, w_fitted, h_fitted = utils.adjust_to_tile(
-                    img, self.meta.tile_size, self.meta.stride, self.meta.ch) \
-                    if self.fit else (img, w_scaled, h_scaled, 0)
+                # load and pad image to fit tile size
+                img = self.__prepare(img_path, scale)
 
                 # fold tensor into tiles
                 img_tiles, n_tiles = self.__split(img)
-
-                self.meta.extract = {
-                    'fid': os.path.basename(img_path.replace('.', '_')) + '_scale_' + str(scale),
-                    'n': n_tiles,
-                    'w_full': w_full,
-                    'h_full': h_full,
-                    'w_scaled': w_scaled,
-                    'h_scaled': h_scaled,
-                    'w_fitted': w_fitted,
-                    'h_fitted': h_fitted,
-                    'offset': 0
-                }
+                n_rows, n_cols = self.get_grid(img)
+                self.meta.extract.update({'n': n_tiles, 'n_rows': n_rows, 'n_cols': n_cols})
 
                 # print results to console and store in metadata
                 self.print_result("Image", img_path, self.meta.extract)
 
                 # check generated tiles against size of buffer
                 if n_tiles > self.imgs_capacity:
-                    errorMessage('Data array reached capacity. Increase the number of tiles per image.')
-                    return
+                    raise PyLCError('Data array reached capacity. Increase the number of tiles per image.')
 
                 # copy tiles to main data arrays
                 np.copyto(self.imgs[self.img_idx:self.img_idx + n_tiles, ...], img_tiles)
@@ -198,6 +195,107 @@ class Extractor(object):
 
         return self
 
+    def stream(self, fit=False, stride=None, scale=None, batch_size=1, read_type='full', window_mem=None):
+        """
+        Generator: lazily extract square image tiles from raw high-resolution
+        images. Tiles are cut from the padded image in batches, in the same
+        (row-major) order as extract(), so that peak memory scales with the
+        batch size rather than the tile buffer capacity. Extraction metadata
+        for the current image is updated before its first batch is yielded.
+
+        Parameters
+        ----------
+        fit: bool
+            Rescale image to fit tile dimensions.
+        stride: int
+            Stride of tile extraction.
+        scale: float
+            Image scaling factor.
+        batch_size: int
+            Number of tiles per batch.
+        read_type: str
+            Image reader: 'full' (decode image), 'windowed' (read tiles in
+            windows from TIFF images where supported) or 'auto' (windowed
+            for images larger than the window memory limit).
+        window_mem: int
+            Image size (MB) above which 'auto' uses windowed reads.
+
+        Yields
+        ------
+        img_tiles: np.array
+            Tile image array; format: [NCHW]
+        coords: np.array
+            Tile grid coordinates (row, column); format: [N2]
+        """
+
+        # parameter overrides
+        if stride:
+            self.meta.stride = stride
+        if scale:
+            self.meta.scales = [scale]
+            self.meta.tiles_per_image = int(self.meta.tiling_factor * scale)
+
+        # rescale image to fit tile dimensions
+        self.fit = fit
+        self.read_type = read_type
+        if window_mem:
+            self.meta.window_mem = window_mem
+
+        # print extraction settings to console
+        self.print_settings()
+
+        n_total = 0
+        for scale in self.meta.scales:
+            print('\nExtraction --- Scaling Factor: {}'.format(scale))
+            for fpair in self.files:
+
+                img_path = fpair.get('img') if type(fpair) == dict else fpair
+
+                # load and pad image to fit tile size
+                img = self.__prepare(img_path, scale)
+                n_rows, n_cols = self.get_grid(img)
+                n_tiles = n_rows * n_cols
+
+                self.meta.extract.update({'n': n_tiles, 'n_rows': n_rows, 'n_cols': n_cols})
+                self.print_result("Image", img_path, self.meta.extract)
+
+                # cut tiles from padded image in batches
+                for i in range(0, n_tiles, batch_size):
+                    idx = np.arange(i, min(i + batch_size, n_tiles))
+                    coords = np.stack(np.divmod(idx, n_cols), axis=1)
+                    with profiler.stage('unfold'):
+                        img_tiles = self.__crop(img, coords)
+                    yield img_tiles, coords
+
+                n_total += n_tiles
+
+        self.meta.n_tiles = n_total
+
+        # print extraction totals
+        print()
+        print('{:30s}{}'.format('Total image tiles generated:', self.meta.n_tiles))
+        print()
+
+    def get_grid(self, img):
+        """
+        Returns tile grid dimensions for image.
+
+        Parameters
+        ----------
+        img: np.array
+            Image file data; formats: grayscale: [HW]; colour: [HWC].
+
+        Returns
+        -------
+        n_rows: int
+            Number of tile rows.
+        n_cols: int
+            Number of tile columns.
+        """
+        n_rows = (img.shape[0] - self.meta.tile_size) // self.meta.stride + 1
+        n_cols = (img.shape[1] - self.meta.tile_size) // self.meta.stride + 1
+        return n_rows, n_cols
+
     def reset(self):
         """
         Resets extractor data buffers.
@@ -210,6 +308,7 @@ class Extractor(object):
         # initialize image/mask arrays
         self.img_path = None
         self.mask_path = None
+        self.save_path = None
         self.files = None
         self.n_files = 0
         self.img_idx = 0
@@ -221,12 +320,52 @@ class Extractor(object):
 
         # extraction parameters
         self.fit = False
+        self.read_type = 'full'
+
+        # decoded image (reused across scales)
+        self.keep_decoded = False
+        self.decoded = None
 
         # generate unique extraction ID
         self.meta.id = '_db_pylc_' + self.meta.ch_label + '_' + str(int(time.time()))
 
         return self
 
+    def get_scaled(self, img_path, scale=None):
+        """
+        Returns image scaled by factor. The image file is decoded once
+        and kept in memory; each scale is resized from the decoded image.
+
+        Parameters
+        ----------
+        img_path: str
+            Image file path.
+        scale: float
+            Image scaling factor.
+
+        Returns
+        -------
+        img: np.array
+            Image file data; formats: grayscale: [HW]; colour: [HWC].
+        w_full: int
+            Image width (px).
+        h_full: int
+            Image height (px).
+        w_scaled: int
+            Image width scaled (px).
+        h_scaled: int
+            Image height scaled (px).
+        """
+        if self.decoded is None or self.decoded[0] != img_path:
+            self.decoded = None
+            with profiler.stage('decode'):
+                self.decoded = (img_path, utils.get_image(img_path, self.meta.ch)[0])
+        img = self.decoded[1]
+        h_full, w_full = img.shape[:2]
+        with profiler.stage('decode'):
+            img, w_scaled, h_scaled = utils.scale_image(img, scale, self.meta.tile_size, interpolate=cv2.INTER_AREA)
+        return img, w_full, h_full, w_scaled, h_scaled
+
     def coshuffle(self):
         """
         Coshuffle dataset
@@ -235,6 +374,142 @@ class Extractor(object):
 
         return self
 
+    def __prepare(self, img_path, scale):
+        """
+        [Private] Load image and adjust to fit tile size. Updates
+        extraction metadata for the image.
+
+        Parameters
+        ----------
+        img_path: str
+            Image file path.
+        scale: float
+            Image scaling factor.
+
+        Returns
+        -------
+        img: np.array
+            Image file data; formats: grayscale: [HW]; colour: [HWC].
+        """
+        # read padded image in windows (large TIFF images)
+        img = self.__open_window(img_path) if self.fit and scale == 1 and not self.keep_decoded else None
+        if img is not None:
+            self.meta.extract = {
+                'fid': os.path.basename(img_path.replace('.', '_')) + '_scale_' + str(scale),
+                'n': 0,
+                'w_full': img.w,
+                'h_full': img.h,
+                'w_scaled': img.w,
+                'h_scaled': img.h,
+                'w_fitted': img.shape[1],
+                'h_fitted': img.shape[0],
+                'offset': 0
+            }
+            return img
+
+        # load image as numpy array (scaling optional)
+        # - decoded image is kept in memory and rescaled for further scales
+        if self.keep_decoded:
+            img, w_full, h_full, w_scaled, h_scaled = self.get_scaled(img_path, scale)
+        else:
+            with profiler.stage('decode'):
+                img, w_full, h_full, w_scaled, h_scaled = utils.get_image(
+                    img_path,
+                    self.meta.ch,
+                    scale=scale,
+                    interpolate=cv2.INTER_AREA,
+                    save_path=self.save_path
+                )
+
+        # adjust image size to fit tile size (optional)
+        with profiler.stage('pad'):
+            img, w_fitted, h_fitted = utils.adjust_to_tile(
+                img, self.meta.tile_size, self.meta.stride, self.meta.ch) \
+                if self.fit else (img, w_scaled, h_scaled)
+
+        self.meta.extract = {
+            'fid': os.path.basename(img_path.replace('.', '_')) + '_scale_' + str(scale),
+            'n': 0,
+            'w_full': w_full,
+            'h_full': h_full,
+            'w_scaled': w_scaled,
+            'h_scaled': h_scaled,
+            'w_fitted': w_fitted,
+            'h_fitted': h_fitted,
+            'offset': 0
+        }
+
+        return img
+
+    def __open_window(self, img_path):
+        """
+        [Private] Opens image for windowed reads if enabled and supported.
+
+        Parameters
+        ----------
+        img_path: str
+            Image file path.
+
+        Returns
+        -------
+        img: WindowedImage
+            Padded image with windowed reads (None: decode full image).
+        """
+        if self.read_type not in ['auto', 'windowed']:
+            return None
+
+        with profiler.stage('decode'):
+            src = utils.open_tiff(img_path)
+        if src is None:
+            if self.read_type == 'windowed':
+                print('Windowed reads not supported for image (decoding full image).')
+            return None
+
+        h, w = src.shape[:2]
+        if self.read_type == 'auto' and np.prod(src.shape, dtype=np.int64) < self.meta.window_mem * 1024 ** 2:
+            return None
+        if min(h, w) < self.meta.tile_size:
+            return None
+
+        # verify image channel number on central window
+        # (mismatches are reported by the full image loader)
+        y, x = max(0, h // 2 - 512), max(0, w // 2 - 512)
+        sample = np.asarray(src[y:y + 1024, x:x + 1024])
+        grayscale = sample.ndim == 2 or utils.is_grayscale(sample)
+        if grayscale != (self.meta.ch == 1):
+            return None
+
+        pad = utils.get_padding(w, h, self.meta.tile_size, self.meta.stride)
+        return WindowedImage(src, self.meta.ch, pad)
+
+    def __crop(self, img, coords):
+        """
+        [Private] Crop tiles at grid coordinates from image.
+
+        Parameters
+        ----------
+        img: np.array
+            Image file data; formats: grayscale: [HW]; colour: [HWC].
+        coords: np.array
+            Tile grid coordinates (row, column); format: [N2]
+
+        Returns
+        -------
+        img_data: np.array
+            Tile image array; format: [NCHW]
+         """
+        ts = self.meta.tile_size
+        ch = 3 if len(img.shape) == 3 else 1
+        img_data = np.empty((len(coords), ch, ts, ts), dtype=np.uint8)
+
+        for i, (row, col) in enumerate(coords):
+            y = row * self.meta.stride
+            x = col * self.meta.stride
+            tile = img[y:y + ts, x:x + ts]
+            img_data[i] = np.moveaxis(tile, -1, 0) if ch == 3 else tile
+
+        return img_data
+
     def __split(self, img):
         """
         [Private] Split image tensor [NCHW] into tiles.
@@ -329,3 +604,71 @@ class Extractor(object):
         if offset:
             print('- {:28s} {}px'.format('Crop (offset)', offset))
         print('- {:28s} {}'.format('Number of Tiles', n))
+
+
+class WindowedImage(object):
+    """
+    Padded image with windowed reads from a memory-mapped or chunked
+    image source, for images too large to decode in memory. Symmetric
+    padding is emulated by reflecting row/column indices at the image
+    borders. Reads are made in full-width strips; the last strip is
+    kept for tiles in the same row.
+
+    Parameters
+    ------
+    src: array-like
+        Image source [HW] or [HWC] supporting slicing.
+    ch: int
+        Number of channels.
+    pad: tuple
+        Padding (top, bottom, left, right).
+    """
+
+    def __init__(self, src, ch, pad):
+        self.src = src
+        self.ch = ch
+        self.h, self.w = src.shape[:2]
+        self.top, bottom, self.left, right = pad
+        self.shape = (self.h + self.top + bottom, self.w + self.left + right) + ((3,) if ch == 3 else ())
+
+        # cached strip
+        self.strip = None
+        self.strip_rows = (0, 0)
+
+    def __getitem__(self, key):
+        """
+        Reads padded image window [rows, columns].
+        """
+        rows, cols = key
+        rows = np.arange(*rows.indices(self.shape[0])) - self.top
+        cols = np.arange(*cols.indices(self.shape[1])) - self.left
+        interior = rows[0] >= 0 and rows[-1] < self.h and cols[0] >= 0 and cols[-1] < self.w
+        rows = utils.reflect_index(rows, self.h)
+        cols = utils.reflect_index(cols, self.w)
+        r0, r1 = rows.min(), rows.max() + 1
+        if r0 < self.strip_rows[0] or r1 > self.strip_rows[1]:
+            self.strip = self.read(r0, r1)
+            self.strip_rows = (r0, r1)
+        rows -= self.strip_rows[0]
+
+        # windows inside image bounds are sliced directly
+        if interior:
+            return self.strip[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        return self.strip[np.ix_(rows, cols)]
+
+    def read(self, r0, r1):
+        """
+        Reads full-width image strip.
+
+        Parameters
+        ------
+        r0: int
+            First row.
+        r1: int
+            Last row (exclusive).
+        """
+        strip = np.asarray(self.src[r0:r1])
+        if self.ch == 3:
+            # drop alpha channel
+            return strip[:, :, :3]
+        return strip[:, :, 0] if strip.ndim == 3 else strip
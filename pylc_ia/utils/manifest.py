@@ -0,0 +1,170 @@
+"""
+(c) 2020 Spencer Rose, MIT Licence
+Python Landscape Classification Tool (PyLC)
+ Reference: An evaluation of deep learning semantic segmentation
+ for land cover classification of oblique ground-based photography,
+ MSc. Thesis 2020.
+ <http://hdl.handle.net/1828/12156>
+Spencer Rose <spencerrose@uvic.ca>, June 2020
+University of Victoria
+
+Module: Batch Manifest Class
+File: manifest.py
+"""
+import os, sys
+import json
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from utils.tools import get_fname, mk_path
+
+
+class Manifest:
+    """
+    Records per-image outputs, run settings and timings of a directory
+    batch run. Saved as JSON (manifest.json) in the output directory and
+    used to skip images with up-to-date outputs.
+
+    Parameters
+    ------
+    output_dir: str
+        Output directory.
+    model_path: str
+        Path to PyLC model.
+    settings: dict
+        Run settings that determine outputs.
+    overwrite: bool
+        Regenerate outputs of all images.
+    """
+
+    def __init__(self, output_dir, model_path, settings, overwrite=False):
+
+        self.output_dir = mk_path(output_dir)
+        self.path = os.path.join(self.output_dir, 'manifest.json')
+        self.model_path = os.path.realpath(model_path)
+        self.settings = settings
+        self.overwrite = overwrite
+        self.images = {}
+
+        # images processed/skipped in current run
+        self.processed = []
+        self.skipped = []
+
+        # load existing manifest
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.images = json.load(f).get('images', {})
+            except (ValueError, OSError) as err:
+                print('Manifest could not be read (outputs will be regenerated):\n\t{}'.format(err))
+
+    def get_outputs(self, img_file):
+        """
+        Returns output paths for image: <stem>_mask.png, <stem>_probs.npy,
+        <stem>_classprobs.npy
+
+        Parameters
+        ------
+        img_file: str
+            Image file path.
+        """
+        stem = get_fname(img_file)
+        return os.path.join(self.output_dir, stem + '_mask.png'), \
+            os.path.join(self.output_dir, stem + '_probs.npy'), \
+            os.path.join(self.output_dir, stem + '_classprobs.npy')
+
+    def is_current(self, img_file, save_probs=True, save_class_probs=False):
+        """
+        Checks if image outputs are up to date: outputs exist, are newer
+        than image and model, and were generated with the same settings.
+
+        Parameters
+        ------
+        img_file: str
+            Image file path.
+        save_probs: bool
+            Probabilities are required outputs.
+        save_class_probs: bool
+            Per-class probabilities are required outputs.
+        """
+        entry = self.images.get(get_fname(img_file))
+        if self.overwrite or entry is None or entry.get('status') not in ['done', 'skipped']:
+            return False
+        if entry.get('model') != self.model_path or entry.get('settings') != self.settings:
+            return False
+
+        mask_file, probs_file, class_probs_file = self.get_outputs(img_file)
+        outputs = [mask_file] + [probs_file] * bool(save_probs) + [class_probs_file] * bool(save_class_probs)
+        if not all(os.path.exists(f) for f in outputs):
+            return False
+        sources = [os.path.getmtime(img_file), os.path.getmtime(self.model_path)]
+        return min(os.path.getmtime(f) for f in outputs) >= max(sources)
+
+    def skip(self, img_file):
+        """
+        Marks image as skipped (outputs up to date).
+
+        Parameters
+        ------
+        img_file: str
+            Image file path.
+        """
+        self.images[get_fname(img_file)]['status'] = 'skipped'
+        self.skipped += [img_file]
+
+    def update(self, img_file, mask_file, probs_file=None, timing=None, class_probs_file=None):
+        """
+        Records generated outputs and timings (s) of image.
+
+        Parameters
+        ------
+        img_file: str
+            Image file path.
+        mask_file: str
+            Output mask path.
+        probs_file: str
+            Output probabilities path.
+        timing: dict
+            Per-stage timings (s).
+        class_probs_file: str
+            Output per-class probabilities path.
+        """
+        self.images[get_fname(img_file)] = {
+            'img': os.path.realpath(img_file),
+            'mask': mask_file,
+            'probs': probs_file,
+            'class_probs': class_probs_file,
+            'model': self.model_path,
+            'settings': self.settings,
+            'status': 'done',
+            'time': {k: round(v, 4) for k, v in (timing or {}).items()},
+            'completed': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        self.processed += [img_file]
+
+    def save(self):
+        """
+        Writes manifest to output directory.
+        """
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'model': self.model_path, 'settings': self.settings, 'images': self.images}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        return self.path
+
+    def print_summary(self):
+        """
+        Prints batch run summary to console.
+        """
+        done = [self.images[get_fname(f)] for f in self.processed]
+        hline = '-' * 40
+        print('\nBatch Run')
+        print(hline)
+        print('{:30s} {}'.format('Output directory', self.output_dir))
+        print('{:30s} {}'.format('Processed', len(done)))
+        print('{:30s} {}'.format('Skipped (up to date)', len(self.skipped)))
+        if done:
+            print('{:30s} {:.2f}s'.format('Mean time per image',
+                                          sum(e['time'].get('total', 0) for e in done) / len(done)))
+        print('{:30s} {}'.format('Manifest', self.path))
+        print(hline)
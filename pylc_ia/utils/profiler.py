@@ -0,0 +1,257 @@
+"""
+(c) 2020 Spencer Rose, MIT Licence
+Python Landscape Classification Tool (PyLC)
+ Reference: An evaluation of deep learning semantic segmentation
+ for land cover classification of oblique ground-based photography,
+ MSc. Thesis 2020.
+ <http://hdl.handle.net/1828/12156>
+Spencer Rose <spencerrose@uvic.ca>, June 2020
+University of Victoria
+
+Module: Stage Profiler
+File: profiler.py
+"""
+import sys
+import json
+import time
+import threading
+import contextlib
+import torch
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    """
+    Peak resident set size of the current process (MB).
+    Returns NaN where unavailable (Windows).
+    """
+    if resource is None:
+        return float('nan')
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS, kilobytes elsewhere
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+class Profiler:
+    """
+    Records wall time, CPU time and peak resident memory of pipeline
+    stages (load_model, decode, pad, unfold, normalize, forward,
+    reconstruct, colourize, write). Stages are marked in code with
+
+        with profiler.stage('decode'):
+            ...
+
+    and cost nothing while the profiler is stopped. Nested stages are
+    timed exclusively: a stage's time excludes the stages run within
+    it (e.g. forward passes pulled lazily by reconstruction). CPU time
+    is process time (all threads), so a CPU/wall ratio below one points
+    to I/O waits, above one to multi-threaded compute.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace = False
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.start_wall = 0.
+        self.start_cpu = 0.
+        self.wall = 0.
+        self.cpu = 0.
+
+    def start(self, trace=False):
+        """
+        Resets stage records and starts profiling.
+
+        Parameters
+        ------
+        trace: bool
+            Label stages in torch.profiler traces.
+        """
+        self.stages = {}
+        self.trace = trace
+        self.enabled = True
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def stop(self):
+        """
+        Stops profiling.
+        """
+        if self.enabled:
+            self.wall = time.perf_counter() - self.start_wall
+            self.cpu = time.process_time() - self.start_cpu
+        self.enabled = False
+        return self
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context manager: records cost of pipeline stage.
+
+        Parameters
+        ------
+        name: str
+            Stage name.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        # per-thread stack of active stages: [child wall, child cpu, child rss growth]
+        stack = self.local.__dict__.setdefault('stack', [])
+        children = [0., 0., 0.]
+        stack.append(children)
+        rss_start = peak_rss()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            if self.trace:
+                with torch.profiler.record_function(name):
+                    yield
+            else:
+                yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            rss = peak_rss()
+            growth = max(0., rss - rss_start)
+            stack.pop()
+            if stack:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+                stack[-1][2] += growth
+            self.add(name, {
+                'calls': 1,
+                'wall': wall - children[0],
+                'cpu': cpu - children[1],
+                'rss_growth_mb': max(0., growth - children[2]),
+                'peak_rss_mb': rss
+            })
+
+    @contextlib.contextmanager
+    def torch_trace(self, path=None):
+        """
+        Context manager: records a torch.profiler trace of the enclosed
+        code and saves it to path (Chrome trace format, viewable in
+        chrome://tracing or Perfetto). Does nothing if no path is given.
+
+        Parameters
+        ------
+        path: str
+            Trace file path.
+        """
+        if not path:
+            yield
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        with torch.profiler.profile(activities=activities) as prof:
+            yield
+        prof.export_chrome_trace(path)
+        print('{:30s} {}'.format('Profiler trace', path))
+
+    def add(self, name, record):
+        """
+        Adds cost record to stage totals.
+
+        Parameters
+        ------
+        name: str
+            Stage name.
+        record: dict
+            Stage cost (calls, wall, cpu, rss_growth_mb, peak_rss_mb).
+        """
+        with self.lock:
+            total = self.stages.setdefault(
+                name, {'calls': 0, 'wall': 0., 'cpu': 0., 'rss_growth_mb': 0., 'peak_rss_mb': 0.})
+            for key in ['calls', 'wall', 'cpu', 'rss_growth_mb']:
+                total[key] += record[key]
+            total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'])
+
+    def collect(self):
+        """
+        Returns and resets stage records (e.g. of a worker process).
+        """
+        with self.lock:
+            stages, self.stages = self.stages, {}
+        return stages
+
+    def merge(self, stages):
+        """
+        Merges stage records (e.g. returned by a worker process).
+
+        Parameters
+        ------
+        stages: dict
+            Stage records.
+        """
+        for name, record in stages.items():
+            self.add(name, record)
+
+    def get_report(self, settings=None):
+        """
+        Returns profiling report.
+
+        Parameters
+        ------
+        settings: dict
+            Run settings (included in report).
+        """
+        stages = {}
+        for name, record in self.stages.items():
+            stages[name] = dict(
+                {k: round(v, 4) if isinstance(v, float) else v for k, v in record.items()},
+                share=round(record['wall'] / self.wall, 4) if self.wall else None)
+        return {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'settings': settings or {},
+            'wall': round(self.wall, 4),
+            'cpu': round(self.cpu, 4),
+            'peak_rss_mb': round(peak_rss(), 1),
+            'stages': stages
+        }
+
+    def save(self, path, settings=None):
+        """
+        Writes profiling report to JSON file.
+
+        Parameters
+        ------
+        path: str
+            Report file path.
+        settings: dict
+            Run settings (included in report).
+        """
+        with open(path, 'w') as f:
+            json.dump(self.get_report(settings), f, indent=2)
+        return path
+
+    def print_report(self):
+        """
+        Prints profiling report to console.
+        """
+        hline = '-' * 72
+        print('\nProfile')
+        print(hline)
+        print('{:14s} {:>7s} {:>10s} {:>7s} {:>10s} {:>10s} {:>10s}'.format(
+            'Stage', 'Calls', 'Wall (s)', 'Share', 'CPU (s)', 'Peak (MB)', '+RSS (MB)'))
+        for name, r in sorted(self.stages.items(), key=lambda item: -item[1]['wall']):
+            print('{:14s} {:>7d} {:>10.3f} {:>6.1f}% {:>10.3f} {:>10.1f} {:>10.1f}'.format(
+                name, r['calls'], r['wall'], 100 * r['wall'] / self.wall if self.wall else 0.,
+                r['cpu'], r['peak_rss_mb'], r['rss_growth_mb']))
+        print(hline)
+        print('{:30s} {:.2f}s'.format('Wall time', self.wall))
+        print('{:30s} {:.2f}s'.format('CPU time (main process)', self.cpu))
+        print('{:30s} {:.1f}MB'.format('Peak RSS', peak_rss()))
+        print(hline)
+
+
+# Create profiler instance (stopped)
+profiler: Profiler = Profiler()
@@ -0,0 +1,170 @@
+"""
+(c) 2020 Spencer Rose, MIT Licence
+Python Landscape Classification Tool (PyLC)
+ Reference: An evaluation of deep learning semantic segmentation
+ for land cover classification of oblique ground-based photography,
+ MSc. Thesis 2020.
+ <http://hdl.handle.net/1828/12156>
+Spencer Rose <spencerrose@uvic.ca>, June 2020
+University of Victoria
+
+Module: Result Cache Class
+File: result_cache.py
+"""
+import os, sys
+import json
+import shutil
+import hashlib
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from utils.tools import file_hash, mk_path
+
+
+class ResultCache:
+    """
+    Persistent content-addressed cache of model outputs (mask and
+    probabilities). Entries are keyed by image and model file hashes
+    and the run settings that determine outputs, and are stored as
+    directories of output files in the cache directory. Cache size is
+    capped by evicting least recently used entries.
+
+    Parameters
+    ------
+    cache_dir: str
+        Cache directory.
+    model_path: str
+        Path to PyLC model.
+    settings: dict
+        Run settings that determine outputs.
+    max_size: int
+        Cache size limit (MB).
+    """
+
+    def __init__(self, cache_dir, model_path, settings, max_size=1024):
+
+        self.cache_dir = mk_path(cache_dir)
+        self.model_hash = file_hash(model_path)
+        self.settings = settings
+        self.max_size = max_size * 2 ** 20
+
+        # images served from cache in current run
+        self.hits = []
+
+    def get_key(self, img_file):
+        """
+        Returns cache key of image: SHA-256 digest of image and model
+        file hashes and run settings.
+
+        Parameters
+        ------
+        img_file: str
+            Image file path.
+        """
+        key = json.dumps({'img': file_hash(img_file), 'model': self.model_hash, 'settings': self.settings},
+                         sort_keys=True)
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get_entry(self, img_file):
+        """
+        Returns entry directory of image.
+
+        Parameters
+        ------
+        img_file: str
+            Image file path.
+        """
+        return os.path.join(self.cache_dir, self.get_key(img_file))
+
+    def restore(self, img_file, outputs):
+        """
+        Copies cached outputs of image to output paths. Returns False
+        (cache miss) unless all outputs are cached.
+
+        Parameters
+        ------
+        img_file: str
+            Image file path.
+        outputs: dict
+            Output paths, by output name ('mask', 'probs', 'class_probs', 'scaled').
+        """
+        entry = self.get_entry(img_file)
+        files = {name: os.path.join(entry, self.get_fname(name, path)) for name, path in outputs.items()}
+        if not all(os.path.isfile(f) for f in files.values()):
+            return False
+        for name, path in outputs.items():
+            shutil.copyfile(files[name], path)
+
+        # mark entry as recently used
+        os.utime(entry)
+        self.hits += [img_file]
+        return True
+
+    def store(self, img_file, outputs):
+        """
+        Adds outputs of image to cache, then evicts least recently used
+        entries beyond the cache size limit.
+
+        Parameters
+        ------
+        img_file: str
+            Image file path.
+        outputs: dict
+            Output paths, by output name ('mask', 'probs', 'class_probs', 'scaled').
+        """
+        if self.max_size <= 0:
+            return
+        entry = self.get_entry(img_file)
+        tmp_entry = '{}.{}.tmp'.format(entry, os.getpid())
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        os.makedirs(tmp_entry)
+        for name, path in outputs.items():
+            shutil.copyfile(path, os.path.join(tmp_entry, self.get_fname(name, path)))
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp_entry, entry)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache is within
+        the size limit.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.isdir(path) and not name.endswith('.tmp'):
+                size = sum(f.stat().st_size for f in os.scandir(path) if f.is_file())
+                entries.append((os.path.getmtime(path), size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    @staticmethod
+    def get_fname(name, path):
+        """
+        Returns cached file name of output (keeps output file extension).
+
+        Parameters
+        ------
+        name: str
+            Output name.
+        path: str
+            Output path.
+        """
+        return name + os.path.splitext(path)[1]
+
+    def print_summary(self):
+        """
+        Prints cache hits to console.
+        """
+        hline = '-' * 40
+        print('\nResult Cache')
+        print(hline)
+        print('{:30s} {}'.format('Cache directory', self.cache_dir))
+        print('{:30s} {}'.format('Served from cache', len(self.hits)))
+        for img_file in self.hits:
+            print('\t{}'.format(img_file))
+        print(hline)
@@ -12,17 +12,32 @@ Module: Utilities
 File: tools.py
 """
 import os, sys
+import zlib
+import struct
+import functools
+import hashlib
 import torch.nn.functional
 import numpy as np
 import torch
 import cv2
 
+# optional: windowed reads of large TIFF images
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from config import defaults
-from interface_tools import errorMessage
+from utils.control import PyLCError
+from utils.profiler import profiler
 
 
-def is_grayscale(img):
+def is_grayscale(img, step=1):
     """
     Checks if loaded image is grayscale. Compares channel
     arrays for equality.
@@ -31,18 +46,20 @@ def is_grayscale(img):
     ------
     img: np.array
         Image data array [HWC].
+    step: int
+        Sampling step along rows and columns (1: compare all pixels).
     """
-    r_ch = img[:, :, 0]
-    g_ch = img[:, :, 1]
-    b_ch = img[:, :, 2]
+    r_ch = img[::step, ::step, 0]
+    g_ch = img[::step, ::step, 1]
+    b_ch = img[::step, ::step, 2]
 
     return np.array_equal(r_ch, g_ch) and np.array_equal(r_ch, b_ch)
 
 
-def get_image(img_path, ch=3, scale=None, tile_size=None, interpolate=cv2.INTER_AREA):
+def get_image(img_path, ch=3, scale=None, tile_size=None, interpolate=cv2.INTER_AREA, save_path=None):
     """
     Loads image data into standard Numpy array
-    Reads image and reverses channel order.
+    Reads image (single decode) and reverses channel order in place.
     Loads image as 8 bit (regardless of original depth)
 
     Parameters
@@ -57,6 +74,8 @@ def get_image(img_path, ch=3, scale=None, tile_size=None, interpolate=cv2.INTER_
         Tile dimension (square).
     interpolate: int
         Interpolation method (OpenCV).
+    save_path: str
+        Save loaded (scaled) image to file (optional).
 
     Returns
     ------
@@ -78,39 +97,93 @@ def get_image(img_path, ch=3, scale=None, tile_size=None, interpolate=cv2.INTER_
     if not tile_size:
         tile_size = defaults.tile_size
 
-    # verify image channel number
+    # load image data
     img = cv2.imread(img_path, cv2.IMREAD_COLOR)
-    if is_grayscale(img) and ch == 3:
-        errorMessage('\nInput image is grayscale but process expects colour (RGB).\n\tApplication stopped.')
-        return
-    elif not is_grayscale(img) and ch == 1:
-        errorMessage('\nInput image is colour (RGB) but process expects grayscale.\n\tApplication stopped.')
-        return
+    if img is None:
+        raise PyLCError('\nImage {} could not be read.\n\tApplication stopped.'.format(img_path))
 
-    # load image data
+    # verify image channel number
+    # - sampled check (colour is confirmed on the full image before rejecting)
+    if ch == 3 and is_grayscale(img, step=8) and is_grayscale(img):
+        raise PyLCError('\nInput image is grayscale but process expects colour (RGB).\n\tApplication stopped.')
+    elif ch == 1 and not is_grayscale(img, step=8):
+        raise PyLCError('\nInput image is colour (RGB) but process expects grayscale.\n\tApplication stopped.')
+
+    # reverse channel order (in place) or extract grayscale channel
     if ch == 3:
-        img = cv2.imread(img_path, cv2.IMREAD_COLOR)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
     else:
-        img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+        img = np.ascontiguousarray(img[:, :, 0])
 
     # get dimensions
     height, width = img.shape[:2]
-    height_resized = height
-    width_resized = width
 
     # apply scaling
+    img, width_resized, height_resized = scale_image(img, scale, tile_size, interpolate)
+
+    # save loaded image (e.g. for display of scaled input)
+    if save_path:
+        save_image(img, save_path, ch)
+
+    return img, width, height, width_resized, height_resized
+
+
+def scale_image(img, scale=None, tile_size=None, interpolate=cv2.INTER_AREA):
+    """
+    Scales image by factor. Scale is adjusted to the minimum size for
+    images smaller than the tile size.
+
+    Parameters
+    ------
+    img: np.array
+        Image array; formats: grayscale: [HW]; colour: [HWC].
+    scale: float
+        Scaling factor.
+    tile_size: int
+        Tile dimension (square).
+    interpolate: int
+        Interpolation method (OpenCV).
+
+    Returns
+    ------
+    numpy array
+        Scaled image array.
+    w_resized: int
+        Image width resized (px).
+    h_resized: int
+        Image height resized (px).
+    """
+    if not tile_size:
+        tile_size = defaults.tile_size
+
+    height, width = img.shape[:2]
     if scale:
         min_dim = min(height, width)
         # adjust scale to minimum size (tile dimensions)
         if min_dim < tile_size:
-            errorMessage("Scale too small. Setting to minimum.")
+            print("Scale too small. Setting to minimum.")
             scale = tile_size / min_dim
         dim = (int(scale * width), int(scale * height))
-        img = cv2.resize(img, dim, interpolation=interpolate)
-        height_resized, width_resized = img.shape[:2]
+        if dim != (width, height):
+            img = cv2.resize(img, dim, interpolation=interpolate)
+    return img, img.shape[1], img.shape[0]
 
-    return img, width, height, width_resized, height_resized
+
+def save_image(img, save_path, ch=3):
+    """
+    Saves image array to file (RGB -> BGR conversion for colour images).
+
+    Parameters
+    ------
+    img: np.array
+        Image array; formats: grayscale: [HW]; colour: [HWC].
+    save_path: str
+        Output file path.
+    ch: int
+        Number of image channels.
+    """
+    cv2.imwrite(save_path, cv2.cvtColor(img, cv2.COLOR_RGB2BGR) if ch == 3 else img)
+    return save_path
 
 
 def adjust_to_tile(img, tile_size, stride, ch, interpolate=cv2.INTER_AREA):
@@ -143,11 +216,38 @@ def adjust_to_tile(img, tile_size, stride, ch, interpolate=cv2.INTER_AREA):
         Size of crop to top of the image.
     """
 
-    # Get full-sized dimensions
-    w = img.shape[1]
-    h = img.shape[0]
+    # Get padding for tiling
+    b, bb, a, aa = get_padding(img.shape[1], img.shape[0], tile_size, stride)
+
+    if ch == 1:
+        img_resized = np.pad(img, pad_width = ((b,bb), (a,aa)), mode = 'symmetric')
+    elif ch == 3:
+        img_resized = np.pad(img, pad_width = ((b,bb), (a,aa), (0,0)), mode = 'symmetric')
+
+    return img_resized, img_resized.shape[1], img_resized.shape[0]
+
+
+def get_padding(w, h, tile_size, stride):
+    """
+    Computes symmetric padding of image to n x tile dimensions with stride.
 
-    assert tile_size % stride == 0 and stride <= tile_size, "Tile size must be multiple of stride."
+    Parameters
+    ------
+    w: int
+        Image width.
+    h: int
+        Image height.
+    tile_size: int
+        Tile dimension.
+    stride: int
+        Stride of tile extraction.
+
+    Returns
+    ------
+    tuple
+        Padding (top, bottom, left, right).
+    """
+    assert 0 < stride <= tile_size, "Stride must not exceed tile size."
 
     # Get padded width for tiling
     if (w-tile_size)%stride == 0:
@@ -160,23 +260,83 @@ def adjust_to_tile(img, tile_size, stride, ch, interpolate=cv2.INTER_AREA):
         h_scaled = (h // stride) * stride + tile_size
 
     a = (w_scaled-w)//2
-    aa = w_scaled - w - a
     b = (h_scaled - h)//2
-    bb = h_scaled - h - b
+    return b, h_scaled - h - b, a, w_scaled - w - a
 
-    if ch == 1:
-        img_resized = np.pad(img, pad_width = ((b,bb), (a,aa)), mode = 'symmetric')
-    elif ch == 3:
-        img_resized = np.pad(img, pad_width = ((b,bb), (a,aa), (0,0)), mode = 'symmetric')
 
-    return img_resized, img_resized.shape[1], img_resized.shape[0]
+def reflect_index(idx, n):
+    """
+    Maps indices outside [0, n) into range by symmetric reflection
+    (equivalent to numpy 'symmetric' padding).
+
+    Parameters
+    ------
+    idx: np.array
+        Indices.
+    n: int
+        Axis length.
+    """
+    idx = np.mod(idx, 2 * n)
+    return np.where(idx >= n, 2 * n - 1 - idx, idx)
 
 
-def reconstruct(logits, meta):
+def open_tiff(img_path):
+    """
+    Opens TIFF image for windowed reads without decoding it: memory-mapped
+    if uncompressed and contiguous, chunked (zarr) otherwise. Requires the
+    optional tifffile (and zarr) packages.
+
+    Parameters
+    ------
+    img_path: str
+        Image file path.
+
+    Returns
+    ------
+    array-like
+        Image source [HW] or [HWC] (8-bit) supporting slicing, or None
+        if the image cannot be read in windows.
+    """
+    if tifffile is None or os.path.splitext(img_path)[1].lower() not in ['.tif', '.tiff']:
+        return None
+    try:
+        with tifffile.TiffFile(img_path) as tif:
+            page = tif.pages[0]
+            # 8-bit grayscale or interleaved RGB(A) only
+            if page.dtype != np.uint8 or page.photometric not in [1, 2, 6]:
+                return None
+            if len(page.shape) != 2 and not (len(page.shape) == 3 and page.shape[-1] in [3, 4]):
+                return None
+            memmappable = page.is_memmappable
+        if memmappable:
+            return tifffile.memmap(img_path, page=0, mode='r')
+        elif zarr is not None:
+            src = zarr.open(tifffile.imread(img_path, aszarr=True, key=0), mode='r')
+            src = src if hasattr(src, 'shape') else src[0]
+            # check that compression codec is available
+            np.asarray(src[:1, :1])
+            return src
+    except Exception as err:
+        print('Windowed reads not available for {}:\n\t{}'.format(img_path, err))
+    return None
+
+
+def reconstruct(logits, meta, class_probs_path=None, as_index=False):
     """
     Reconstruct tiles into full-sized segmentation mask.
     Uses metadata generated from image tiling (adjust_to_tile)
 
+    Parameters
+    ------
+    logits: list
+        Batches of tile logits [NCHW].
+    meta: Parameters
+        Extraction metadata.
+    class_probs_path: str
+        Per-class probabilities output path (optional, see open_class_probs).
+    as_index: bool
+        Return class index map [HW] instead of colourized mask.
+
       Returns
       ------
       mask_reconstructed: np.array
@@ -215,17 +375,7 @@ def reconstruct(logits, meta):
     row_idx = offset
 
     # anti-tile artifact code
-    for tile in tiles:
-        tileshape = tile.shape[1:]
-        indices = np.indices(tileshape)
-        center = np.array(tileshape) // 2
-        distances = np.sqrt(np.sum((indices - center[:, np.newaxis, np.newaxis])**2, axis=0))
-
-
-        for lc in range(tile.shape[0]):
-            a = tile[lc]/(1+np.exp(0.1*distances-20))
-            b = tile[lc]*((1/(1+np.exp(-0.1*distances+20)))+1)
-            tile[lc] = np.where(tile[lc]>0, a, b)
+    weight_tiles(tiles, tile_size)
 
     for i in range(n_strides_in_col):
         # Get initial tile in row
@@ -290,9 +440,10 @@ def reconstruct(logits, meta):
     # colourize to palette
     mask_fullsized = np.expand_dims(mask_fullsized, axis=0)
 
-    _mask_pred = colourize(np.argmax(mask_fullsized, axis=1), n_classes, palette=palette)
+    class_map = np.argmax(mask_fullsized, axis=1)
 
-    probs_reconstructed = torch.max(torch.nn.functional.softmax(torch.tensor(mask_fullsized), dim=1), dim=1).values.numpy()
+    probs_fullsized = torch.nn.functional.softmax(torch.tensor(mask_fullsized), dim=1)
+    probs_reconstructed = torch.max(probs_fullsized, dim=1).values.numpy()
 
     #crop mask and probabilities to image size
     a = (w - w_full)//2
@@ -300,17 +451,434 @@ def reconstruct(logits, meta):
     b = (h - h_full)//2
     bb = h - h_full - b
 
+    if class_probs_path:
+        save_class_probs(class_probs_path, probs_fullsized.numpy()[0, :, b:b + h_full, a:a + w_full])
+
     probs_reconstructed = probs_reconstructed[0,b:probs_reconstructed.shape[1]-bb,a:probs_reconstructed.shape[2]-aa].astype('float16')
 
-    mask_reconstructed = _mask_pred[0,b:_mask_pred.shape[1]-bb,a:_mask_pred.shape[2]-aa,:].astype('float32')
+    class_map = class_map[:,b:class_map.shape[1]-bb,a:class_map.shape[2]-aa]
+
+    if as_index:
+        return class_map[0].astype(np.uint8), probs_reconstructed
+
+    mask_reconstructed = colourize(class_map, n_classes, palette=palette)[0]
+
+    return mask_reconstructed, probs_reconstructed
+
+
+def reconstruct_weighted(logits, meta, class_probs_path=None, as_index=False):
+    """
+    Reconstruct tiles into full-sized segmentation mask by weighted
+    accumulation. Per-class tile probabilities, weighted by distance
+    from the tile centre, and per-pixel weights are scatter-added into
+    two accumulators in a single pass, then normalized once. Supports
+    any stride/overlap. Uses metadata generated from image tiling
+    (adjust_to_tile)
+
+    Parameters
+    ------
+    logits: list
+        Batches of tile logits [NCHW].
+    meta: Parameters
+        Extraction metadata.
+    class_probs_path: str
+        Per-class probabilities output path (optional, see open_class_probs).
+    as_index: bool
+        Return class index map [HW] instead of colourized mask.
+
+      Returns
+      ------
+      mask_reconstructed: np.array
+         Reconstructed image data.
+      probs_reconstructed: np.array
+         Probability of most probable class.
+     """
+
+    # get tiles from tensor outputs
+    logits = [t.cpu() for t in logits] if torch.cuda.is_available() else logits
+    tiles = np.concatenate(logits, axis=0)
+
+    # load metadata
+    w = meta.extract['w_fitted']
+    h = meta.extract['h_fitted']
+    w_full = meta.extract['w_scaled']
+    h_full = meta.extract['h_scaled']
+    tile_size = meta.tile_size
+    stride = meta.stride
+    palette = meta.palette_rgb
+    n_classes = meta.n_classes
+
+    n_cols = (w - tile_size) // stride + 1
+
+    # tile weight window (positive logistic falloff from tile centre)
+    window, _ = get_tile_weights(tile_size)
+
+    # class probability and weight accumulators
+    probs_acc = np.zeros((n_classes, h, w), dtype=np.float32)
+    weights_acc = np.zeros((h, w), dtype=np.float32)
+
+    for i, tile in enumerate(tiles):
+        y = (i // n_cols) * stride
+        x = (i % n_cols) * stride
+        probs = torch.nn.functional.softmax(torch.as_tensor(tile), dim=0).numpy()
+        probs_acc[:, y:y + tile_size, x:x + tile_size] += probs * window
+        weights_acc[y:y + tile_size, x:x + tile_size] += window
+
+    # normalize
+    probs_acc /= weights_acc
+
+    # crop mask and probabilities to image size
+    a = (w - w_full)//2
+    b = (h - h_full)//2
+    probs_acc = probs_acc[:, b:b + h_full, a:a + w_full]
+
+    if class_probs_path:
+        save_class_probs(class_probs_path, probs_acc)
+
+    class_map = np.argmax(probs_acc, axis=0).astype(np.uint8)
+    probs_reconstructed = np.max(probs_acc, axis=0).astype('float16')
+    if as_index:
+        return class_map, probs_reconstructed
+
+    mask_reconstructed = colourize(class_map[np.newaxis], n_classes, palette=palette)[0]
 
     return mask_reconstructed, probs_reconstructed
 
 
+def reconstruct_bands(logits, meta):
+    """
+    Generator: reconstruct tile logits into horizontal bands of the
+    segmentation mask. Tiles are consumed in (row-major) extraction
+    order; weighted class probabilities are accumulated in a rolling
+    buffer one tile high, and each band is finalized as soon as no
+    further tiles overlap it. The full logit cube is never materialized.
+    Extraction metadata (including stride) is read once the first
+    batch is received.
+
+    Parameters
+    ------
+    logits: iterable
+        Batches of tile logits [NCHW].
+    meta: Parameters
+        Extraction metadata.
+
+    Yields
+    ------
+    y: int
+        First row of band in fitted image.
+    classes: np.array
+        Most probable class index [HW].
+    probs: np.array
+        Probability of most probable class [HW].
+    band: np.array
+        Class probabilities [CHW].
+    """
+    probs_acc = None
+    row = 0
+    i = 0
+
+    def finalize(n_rows):
+        band = probs_acc[:, :n_rows] / weights_acc[:n_rows]
+        return row * stride, np.argmax(band, axis=0).astype(np.uint8), np.max(band, axis=0), band
+
+    for batch in logits:
+        batch = batch.cpu() if torch.is_tensor(batch) else torch.as_tensor(batch)
+
+        # initialize rolling accumulators
+        if probs_acc is None:
+            tile_size = meta.tile_size
+            stride = meta.stride
+            window, _ = get_tile_weights(tile_size)
+            w = meta.extract['w_fitted']
+            n_cols = (w - tile_size) // stride + 1
+            probs_acc = np.zeros((meta.n_classes, tile_size, w), dtype=np.float32)
+            weights_acc = np.zeros((tile_size, w), dtype=np.float32)
+
+        for probs in torch.nn.functional.softmax(batch, dim=1).numpy():
+            r, c = divmod(i, n_cols)
+            # previous tile row complete: emit band and shift buffer up
+            if r > row:
+                yield finalize(stride)
+                probs_acc[:, :tile_size - stride] = probs_acc[:, stride:]
+                probs_acc[:, tile_size - stride:] = 0
+                weights_acc[:tile_size - stride] = weights_acc[stride:]
+                weights_acc[tile_size - stride:] = 0
+                row = r
+            x = c * stride
+            probs_acc[:, :, x:x + tile_size] += probs * window
+            weights_acc[:, x:x + tile_size] += window
+            i += 1
+
+    # emit last tile row
+    if probs_acc is not None:
+        yield finalize(tile_size)
+
+
+def reconstruct_streamed(logits, meta, class_probs_path=None, as_index=False):
+    """
+    Reconstruct tiles into full-sized segmentation mask from
+    streamed reconstruction bands (see reconstruct_bands). Only
+    the class index and probability maps are held at full size;
+    per-class probabilities are written to file band by band.
+
+    Parameters
+    ------
+    logits: iterable
+        Batches of tile logits [NCHW].
+    meta: Parameters
+        Extraction metadata.
+    class_probs_path: str
+        Per-class probabilities output path (optional, see open_class_probs).
+    as_index: bool
+        Return class index map [HW] instead of colourized mask.
+
+      Returns
+      ------
+      mask_reconstructed: np.array
+         Reconstructed image data.
+      probs_reconstructed: np.array
+         Probability of most probable class.
+     """
+    class_map = None
+    class_probs = None
+    for y, classes, probs, band in reconstruct_bands(logits, meta):
+        if class_map is None:
+            w = meta.extract['w_fitted']
+            h = meta.extract['h_fitted']
+            w_full = meta.extract['w_scaled']
+            h_full = meta.extract['h_scaled']
+            a = (w - w_full)//2
+            b = (h - h_full)//2
+            class_map = np.zeros((h_full, w_full), dtype=np.uint8)
+            probs_reconstructed = np.zeros((h_full, w_full), dtype=np.float16)
+            if class_probs_path:
+                class_probs = open_class_probs(class_probs_path, meta.n_classes, h_full, w_full)
+
+        # crop band to image size
+        y0 = max(y, b)
+        y1 = min(y + classes.shape[0], b + h_full)
+        if y1 > y0:
+            class_map[y0 - b:y1 - b] = classes[y0 - y:y1 - y, a:a + w_full]
+            probs_reconstructed[y0 - b:y1 - b] = probs[y0 - y:y1 - y, a:a + w_full]
+            if class_probs is not None:
+                class_probs[:, y0 - b:y1 - b] = quantize_probs(band[:, y0 - y:y1 - y, a:a + w_full])
+
+    if class_probs is not None:
+        class_probs.flush()
+        del class_probs
+
+    if as_index:
+        return class_map, probs_reconstructed
+
+    mask_reconstructed = colourize(class_map[np.newaxis], meta.n_classes, palette=meta.palette_rgb)[0]
+
+    return mask_reconstructed, probs_reconstructed
+
+
+def reconstruct_probs(logits, meta):
+    """
+    Reconstruct tiles into full-sized class probabilities from
+    streamed reconstruction bands (see reconstruct_bands).
+
+    Parameters
+    ------
+    logits: iterable
+        Batches of tile logits [NCHW].
+    meta: Parameters
+        Extraction metadata.
+
+    Returns
+    ------
+    probs_reconstructed: np.array
+        Class probabilities [CHW] (scaled image size).
+    """
+    probs_reconstructed = None
+    for y, classes, probs, band in reconstruct_bands(logits, meta):
+        if probs_reconstructed is None:
+            w = meta.extract['w_fitted']
+            h = meta.extract['h_fitted']
+            w_full = meta.extract['w_scaled']
+            h_full = meta.extract['h_scaled']
+            a = (w - w_full)//2
+            b = (h - h_full)//2
+            probs_reconstructed = np.zeros((meta.n_classes, h_full, w_full), dtype=np.float32)
+
+        # crop band to image size
+        y0 = max(y, b)
+        y1 = min(y + classes.shape[0], b + h_full)
+        if y1 > y0:
+            probs_reconstructed[:, y0 - b:y1 - b] = band[:, y0 - y:y1 - y, a:a + w_full]
+
+    return probs_reconstructed
+
+
+def resize_probs(probs, w, h):
+    """
+    Resizes class probabilities (bilinear interpolation).
+
+    Parameters
+    ------
+    probs: np.array
+        Class probabilities [CHW].
+    w: int
+        Output width.
+    h: int
+        Output height.
+
+    Returns
+    ------
+    np.array
+        Resized class probabilities [CHW].
+    """
+    if probs.shape[1:] == (h, w):
+        return probs
+    return np.stack([cv2.resize(plane, (w, h), interpolation=cv2.INTER_LINEAR) for plane in probs])
+
+
+def open_class_probs(path, n_classes, h, w):
+    """
+    Creates per-class probability output file: a class-major [CHW]
+    uint8 array (probability * 255) in NumPy .npy format. Each class
+    plane is stored contiguously, so readers can memory-map the file
+    (np.load(path, mmap_mode='r')) and access class planes or row
+    slices without loading the full array.
+
+    Parameters
+    ------
+    path: str
+        Output file path (.npy).
+    n_classes: int
+        Number of classes.
+    h: int
+        Image height.
+    w: int
+        Image width.
+
+    Returns
+    ------
+    class_probs: np.memmap
+        Writable memory-mapped array [CHW].
+    """
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(n_classes, h, w))
+
+
+def save_class_probs(path, probs):
+    """
+    Saves per-class probabilities to file (see open_class_probs).
+    Class planes are quantized and written one at a time.
+
+    Parameters
+    ------
+    path: str
+        Output file path (.npy).
+    probs: np.array
+        Class probabilities [CHW].
+    """
+    class_probs = open_class_probs(path, *probs.shape)
+    for i, plane in enumerate(probs):
+        class_probs[i] = quantize_probs(plane)
+    class_probs.flush()
+    return path
+
+
+def quantize_probs(probs):
+    """
+    Quantizes probabilities [0, 1] to uint8 (p * 255, rounded).
+
+    Parameters
+    ------
+    probs: np.array
+        Probabilities.
+    """
+    return np.rint(np.clip(probs, 0., 1.) * 255).astype(np.uint8)
+
+
+@functools.lru_cache(maxsize=None)
+def get_tile_weights(tile_size):
+    """
+    Anti-tile artifact weight maps for square tiles. Logits are
+    attenuated with distance from the tile centre by a logistic
+    function. Maps depend only on tile size and are cached.
+
+    Parameters
+    ------
+    tile_size: int
+        Tile dimension.
+
+    Returns
+    ------
+    w_pos: np.array
+        Weights for positive logits [HW] (read-only).
+    w_neg: np.array
+        Weights for non-positive logits [HW] (read-only).
+    """
+    indices = np.indices((tile_size, tile_size))
+    center = np.array((tile_size, tile_size)) // 2
+    distances = np.sqrt(np.sum((indices - center[:, np.newaxis, np.newaxis])**2, axis=0))
+
+    w_pos = (1 / (1 + np.exp(0.1 * distances - 20))).astype(np.float32)
+    w_neg = ((1 / (1 + np.exp(-0.1 * distances + 20))) + 1).astype(np.float32)
+    w_pos.setflags(write=False)
+    w_neg.setflags(write=False)
+
+    return w_pos, w_neg
+
+
+def weight_tiles(tiles, tile_size):
+    """
+    Apply anti-tile artifact weighting to tile logits (in place).
+    Weight maps are broadcast over the full tile stack [NCHW].
+
+    Parameters
+    ------
+    tiles: np.array
+        Tile logits [NCHW].
+    tile_size: int
+        Tile dimension.
+
+    Returns
+    ------
+    np.array
+        Weighted tile logits [NCHW].
+    """
+    w_pos, w_neg = get_tile_weights(tile_size)
+    tiles *= np.where(tiles > 0, w_pos, w_neg)
+    return tiles
+
+
+def get_palette(palette=None):
+    """
+    Palette lookup table mapping class indices to RGB colours.
+    Tables are cached by palette.
+
+    Parameters
+    ------
+    palette: list
+        Colour palette for mask [C3].
+
+    Returns
+    ------
+    numpy array
+        Palette lookup table [C3] (uint8, read-only).
+    """
+    palette = palette if palette is not None else defaults.palette_rgb
+    return _palette_lut(tuple(tuple(colour) for colour in palette))
+
+
+@functools.lru_cache(maxsize=None)
+def _palette_lut(palette):
+    """
+    [Private] Builds palette lookup table (see get_palette).
+    """
+    lut = np.array(palette, dtype=np.uint8)
+    lut.setflags(write=False)
+    return lut
+
+
 def colourize(img, n_classes, palette=None):
     """
-        Colourize one-hot encoded image by palette
-        Input format: NCWH (one-hot class encoded).
+        Colourize class-index encoded image by palette
+        Input format: NWH (class indices).
 
         Parameters
         ------
@@ -324,26 +892,12 @@ def colourize(img, n_classes, palette=None):
         Returns
         ------
         numpy array
-            Colourized image array.
+            Colourized image array [NWH3] (uint8).
     """
 
-    palette = palette if palette is not None else defaults.palette_rgb
-
-    n = img.shape[0]
-    w = img.shape[1]
-    h = img.shape[2]
-
-    # collapse one-hot encoding to single channel
-    # make 3-channel (RGB) image
-    img_data = np.moveaxis(np.stack((img,) * 3, axis=1), 1, -1).reshape(n * w * h, 3)
-
     # map categories to palette colours
-    for i in range(n_classes):
-        class_bool = img_data == np.array([i, i, i])
-        class_idx = np.all(class_bool, axis=1)
-        img_data[class_idx] = palette[i]
-
-    return img_data.reshape(n, w, h, 3)
+    with profiler.stage('colourize'):
+        return get_palette(palette)[:n_classes][img]
 
 
 def coshuffle(img_array, mask_array):
@@ -397,6 +951,76 @@ def map_palette(img_array, key):
     return torch.tensor(key[index].reshape(img_array.shape))
 
 
+def pack_rgb(img, bgr=False):
+    """
+    Pack 8-bit RGB colour values into 24-bit integers (0xRRGGBB).
+
+    Parameters
+    ------
+    img: np.array
+        Colour array [...3] (uint8).
+    bgr: bool
+        Input channel order is BGR (OpenCV).
+
+    Returns
+    ------
+    numpy array
+        Packed colour values [...] (uint32).
+    """
+    r, g, b = (2, 1, 0) if bgr else (0, 1, 2)
+    packed = img[..., r].astype(np.uint32) << 16
+    packed |= img[..., g].astype(np.uint32) << 8
+    packed |= img[..., b]
+    return packed
+
+
+def decode_rgb(img, palette=None, bgr=False, fill=1):
+    """
+    Decode RGB mask colours to class indices. Colours are packed into
+    24-bit integers and matched to the palette with a single sorted
+    search. Colours not in the palette are assigned the fill index
+    and counted per colour.
+
+    Parameters
+    ------
+    img: np.array
+        Mask array [...3] (uint8).
+    palette: list
+        Colour palette for mask.
+    bgr: bool
+        Input channel order is BGR (OpenCV).
+    fill: int
+        Class index for unknown colours.
+
+    Returns
+    ------
+    numpy array
+        Class-index encoded mask [...] (uint8).
+    dict
+        Pixel counts of unknown colours (by hex value).
+    """
+    lut = get_palette(palette)
+    keys = pack_rgb(lut)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    packed = pack_rgb(img, bgr=bgr)
+    idx = np.searchsorted(sorted_keys, packed)
+    np.minimum(idx, len(sorted_keys) - 1, out=idx)
+    known = sorted_keys[idx] == packed
+
+    encoded = order[idx].astype(np.uint8)
+    encoded[~known] = fill
+
+    # count unknown colours
+    unknown = {}
+    if not known.all():
+        colours, counts = np.unique(packed[~known], return_counts=True)
+        unknown = {'#{:06x}'.format(c): int(n) for c, n in zip(colours, counts)}
+
+    return encoded, unknown
+
+
 def class_encode(img_array, palette):
     """
     Convert RGB mask array to class-index encoded values.
@@ -420,20 +1044,198 @@ def class_encode(img_array, palette):
 
     assert img_array.shape[1] == 3, "Input data must be 3 channel (RGB)"
 
-    (n, ch, w, h) = img_array.shape
-    input_data = np.moveaxis(img_array.numpy(), 1, -1).reshape(n * w * h, ch)
-    encoded_data = np.ones(n * w * h)
-
     # map mask colours to segmentation classes
-    try:
-        for idx, c in enumerate(palette):
-            bool_idx = input_data == np.array(c)
-            bool_idx = np.all(bool_idx, axis=1)
-            encoded_data[bool_idx] = idx
-    except Exception as inst:
-        errorMessage('Mask cannot be encoded by selected palette. Please check schema settings.')
-        exit(1)
-    return torch.tensor(encoded_data.reshape(n, w, h), dtype=torch.uint8)
+    input_data = np.moveaxis(img_array.numpy().astype(np.uint8, copy=False), 1, -1)
+    encoded_data, unknown = decode_rgb(input_data, palette)
+    print_unknown(unknown)
+
+    return torch.tensor(encoded_data, dtype=torch.uint8)
+
+
+def get_mask(mask_path, palette=None):
+    """
+    Loads RGB mask image as class-index encoded array.
+    Mask is decoded once (colour order is resolved when packing).
+
+    Parameters
+    ------
+    mask_path: str
+        Mask file path.
+    palette: list
+        Colour palette for mask.
+
+    Returns
+    ------
+    numpy array
+        Class-index encoded mask [HW] (uint8).
+    dict
+        Pixel counts of unknown colours (by hex value).
+    """
+    assert os.path.exists(mask_path), 'Mask path {} does not exist.'.format(mask_path)
+
+    # class index raster: palette entries are mapped to class indices
+    raster = read_class_raster(mask_path)
+    if raster is not None:
+        class_map, raster_palette = raster
+        lut, _ = decode_rgb(np.array(raster_palette, dtype=np.uint8), palette)
+        counts = np.bincount(class_map.ravel(), minlength=len(raster_palette))
+        known = set(pack_rgb(get_palette(palette)).tolist())
+        unknown = {'#{:06x}'.format(c): int(counts[i]) for i, c in enumerate(pack_rgb(np.array(raster_palette, dtype=np.uint8)).tolist())
+                   if c not in known and counts[i] > 0}
+        print_unknown(unknown, mask_path)
+        return lut[class_map], unknown
+
+    mask = cv2.imread(mask_path, cv2.IMREAD_COLOR)
+    encoded, unknown = decode_rgb(mask, palette, bgr=True)
+    print_unknown(unknown, mask_path)
+
+    return encoded, unknown
+
+
+def save_class_raster(path, class_map, palette=None, level=6):
+    """
+    Saves class index map as single-band 8-bit PNG with an embedded
+    colour table (palette). Pixel values are class indices; image
+    viewers and GIS software (GDAL) display the palette colours.
+
+    Parameters
+    ------
+    path: str
+        Output file path (PNG).
+    class_map: np.array
+        Class index map [HW] (uint8).
+    palette: list
+        Colour palette for mask (RGB).
+    level: int
+        Compression level (zlib).
+    """
+    class_map = np.asarray(class_map, dtype=np.uint8)
+    h, w = class_map.shape
+    lut = get_palette(palette)
+
+    # scanlines are prefixed with filter type 0 (none)
+    rows = np.zeros((h, w + 1), dtype=np.uint8)
+    rows[:, 1:] = class_map
+
+    with open(path, 'wb') as f:
+        f.write(_PNG_SIGNATURE)
+        _write_png_chunk(f, b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 3, 0, 0, 0))
+        _write_png_chunk(f, b'PLTE', lut.tobytes())
+        _write_png_chunk(f, b'IDAT', zlib.compress(rows.tobytes(), level))
+        _write_png_chunk(f, b'IEND', b'')
+    return path
+
+
+def read_class_raster(path):
+    """
+    Reads single-band 8-bit PNG with colour table (see save_class_raster).
+    Returns None if the file is not a class index raster (e.g. RGB mask).
+
+    Parameters
+    ------
+    path: str
+        Raster file path.
+
+    Returns
+    ------
+    class_map: np.array
+        Class index map [HW] (uint8).
+    palette: list
+        Colour palette (RGB).
+    """
+    if not is_class_raster(path):
+        return None
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    # parse chunks
+    pos = len(_PNG_SIGNATURE)
+    header, palette, idat = None, None, []
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        if chunk_type == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif chunk_type == b'PLTE':
+            palette = np.frombuffer(chunk, dtype=np.uint8).reshape(-1, 3)
+        elif chunk_type == b'IDAT':
+            idat.append(chunk)
+        elif chunk_type == b'IEND':
+            break
+        pos += length + 12
+    w, h, depth, colour_type, _, _, interlace = header
+    if depth != 8 or colour_type != 3 or interlace or palette is None:
+        return None
+
+    rows = np.frombuffer(zlib.decompress(b''.join(idat)), dtype=np.uint8).reshape(h, w + 1)
+    filters = rows[:, 0]
+    class_map = rows[:, 1:].copy()
+
+    # undo scanline filters: none, sub (1) and up (2) are decoded directly;
+    # average/Paeth filtered files (written by other software) are read as colour
+    if np.any(filters > 2):
+        class_map, _ = decode_rgb(cv2.imread(path, cv2.IMREAD_COLOR), palette.tolist(), bgr=True)
+    else:
+        sub = filters == 1
+        class_map[sub] = np.cumsum(class_map[sub], axis=1, dtype=np.uint8)
+        for i in np.flatnonzero(filters == 2):
+            if i > 0:
+                class_map[i] += class_map[i - 1]
+
+    return class_map, palette.tolist()
+
+
+def is_class_raster(path):
+    """
+    Checks if file is a single-band 8-bit PNG with colour table (class
+    index raster). Reads the file header only.
+
+    Parameters
+    ------
+    path: str
+        Raster file path.
+    """
+    if not path or not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        head = f.read(len(_PNG_SIGNATURE) + 25)
+    if len(head) < len(_PNG_SIGNATURE) + 25 or not head.startswith(_PNG_SIGNATURE) or head[12:16] != b'IHDR':
+        return False
+    depth, colour_type = head[24], head[25]
+    return depth == 8 and colour_type == 3
+
+
+# PNG file signature
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _write_png_chunk(f, chunk_type, data):
+    """
+    [Private] Writes PNG chunk (length, type, data, CRC).
+    """
+    f.write(struct.pack('>I', len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def print_unknown(unknown, mask_path=None):
+    """
+    Prints mask colours not found in the palette to console.
+
+    Parameters
+    ------
+    unknown: dict
+        Pixel counts of unknown colours (by hex value).
+    mask_path: str
+        Mask file path (optional).
+    """
+    if not unknown:
+        return
+    print('\nMask colours not in palette{}:'.format(
+        ' ({})'.format(os.path.basename(mask_path)) if mask_path else ''))
+    for colour, count in sorted(unknown.items(), key=lambda item: -item[1]):
+        print('- {:28s} {}px'.format(colour, count))
 
 
 def load_files(path, exts):
@@ -453,8 +1255,7 @@ def load_files(path, exts):
          List of file names.
      """
     if not os.path.exists(path):
-        errorMessage('File not found:\n\t{} .'.format(path))
-        return
+        raise PyLCError('File not found:\n\t{} .'.format(path))
 
     files = []
     if os.path.isfile(path):
@@ -483,6 +1284,39 @@ def get_fname(path):
     return path
 
 
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Computes SHA-256 digest of file contents. Digests are cached in
+    process by file path, size and modification time.
+
+    Parameters
+    ------
+    path: str
+        File path.
+    chunk_size: int
+        Read buffer size (bytes).
+
+    Returns
+    ------
+    str
+        Hexadecimal digest.
+    """
+    stat = os.stat(path)
+    return file_digest(os.path.realpath(path), stat.st_size, stat.st_mtime_ns, chunk_size)
+
+
+@functools.lru_cache(maxsize=256)
+def file_digest(path, size, mtime, chunk_size):
+    """
+    Computes SHA-256 digest of file contents (see file_hash).
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def mk_path(path, check=True):
     """
     Makes directory at path if none exists.
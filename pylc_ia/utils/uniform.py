@@ -0,0 +1,266 @@
+"""
+(c) 2020 Spencer Rose, MIT Licence
+Python Landscape Classification Tool (PyLC)
+ Reference: An evaluation of deep learning semantic segmentation
+ for land cover classification of oblique ground-based photography,
+ MSc. Thesis 2020.
+ <http://hdl.handle.net/1828/12156>
+Spencer Rose <spencerrose@uvic.ca>, June 2020
+University of Victoria
+
+Module: Uniform Tile Short-circuit
+File: uniform.py
+"""
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import torch
+
+
+class UniformTiles:
+    """
+    Short-circuits the forward pass for near-uniform tiles (e.g. sky,
+    blank image borders). Tiles are screened with cheap statistics on
+    the uint8 tile: a tile is uniform if the standard deviation of each
+    channel is at most max_std. Uniform tiles are keyed by appearance
+    (channel means quantized to bucket levels); the first tile of an
+    appearance is classified and its model output is cached, later
+    tiles of the same appearance are filled with the cached output.
+    The cache is capped at max_size (MB) by evicting least recently
+    used appearances (an evicted appearance is classified again).
+
+    With check enabled, filled tiles are also classified and the
+    agreement of cached and full predictions is reported (no forward
+    passes are saved).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.max_std = 4.
+        self.bucket = 8
+        self.check = False
+        self.max_size = 256 * 2 ** 20
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def start(self, max_std=4., bucket=8, check=False, max_size=256):
+        """
+        Resets cache and statistics and starts screening tiles.
+
+        Parameters
+        ------
+        max_std: float
+            Maximum per-channel standard deviation of uniform tiles (uint8 levels).
+        bucket: int
+            Quantization step of channel means (appearance buckets).
+        check: bool
+            Classify filled tiles and report agreement with cached predictions.
+        max_size: int
+            Cache size limit (MB) of cached model outputs.
+        """
+        self.max_std = float(max_std)
+        self.bucket = max(1, int(bucket))
+        self.check = check
+        self.max_size = max(0, max_size) * 2 ** 20
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.stats = self.get_empty()
+        self.enabled = True
+        return self
+
+    def stop(self):
+        """
+        Stops screening tiles (cached predictions are released).
+        """
+        self.enabled = False
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        return self
+
+    @staticmethod
+    def get_empty():
+        """
+        Returns empty statistics record.
+        """
+        return {'tiles': 0, 'uniform': 0, 'filled': 0, 'batches': 0, 'batches_skipped': 0,
+                'forward_tiles': 0, 'forward_time': 0., 'appearances': 0,
+                'checked_px': 0, 'agree_px': 0, 'evicted': 0}
+
+    def get_key(self, tile):
+        """
+        Returns appearance key of tile (quantized channel means),
+        or None if tile is not uniform.
+
+        Parameters
+        ------
+        tile: np.array
+            Image tile (uint8) [CHW].
+        """
+        px = tile.reshape(tile.shape[0], -1)
+        if np.any(px.std(axis=1) > self.max_std):
+            return None
+        return tuple(int(m) // self.bucket for m in px.mean(axis=1))
+
+    def predict(self, model, img_tiles):
+        """
+        Applies model to batch of tiles: uniform tiles with a cached
+        appearance are filled with the cached model output, remaining
+        tiles are classified (one forward pass).
+
+        Parameters
+        ------
+        model: Model
+            Loaded PyLC model.
+        img_tiles: np.array
+            Image tiles (uint8) [NCHW].
+
+        Returns
+        ------
+        list
+            Model output logits [NCHW] (see Model.test).
+        """
+        keys = [self.get_key(tile) for tile in img_tiles]
+
+        # classify non-uniform tiles and the first tile of each new appearance
+        run, new = [], {}
+        for i, key in enumerate(keys):
+            if key is None or (key not in self.cache and key not in new):
+                run.append(i)
+                if key is not None:
+                    new[key] = i
+        filled = [i for i in range(len(keys)) if i not in run]
+        forward = list(range(len(keys))) if self.check else run
+
+        stats = self.get_empty()
+        stats.update({'tiles': len(keys), 'uniform': sum(key is not None for key in keys),
+                      'filled': len(filled), 'batches': 1, 'batches_skipped': int(not forward),
+                      'forward_tiles': len(forward)})
+
+        y_hat = None
+        if forward:
+            start = time.perf_counter()
+            y_hat = model.test(torch.Tensor(img_tiles[forward]))[0]
+            stats['forward_time'] = time.perf_counter() - start
+
+        # cached outputs of batch appearances (hits are marked recently used)
+        outputs = {}
+        for key in set(keys[i] for i in filled):
+            if key in new:
+                outputs[key] = y_hat[forward.index(new[key])]
+            else:
+                outputs[key] = self.cache[key]
+                self.cache.move_to_end(key)
+
+        # assemble batch outputs
+        template = y_hat[0] if y_hat is not None else outputs[keys[0]]
+        logits = template.new_empty((len(keys),) + tuple(template.shape))
+        for j, i in enumerate(forward):
+            logits[i] = y_hat[j]
+        for i in filled:
+            logits[i] = outputs[keys[i]]
+
+        for key, i in new.items():
+            self.put(key, y_hat[forward.index(i)].clone())
+        stats['evicted'] = self.evict()
+
+        # agreement of cached and full predictions of filled tiles
+        if self.check and filled:
+            cached = torch.argmax(logits[filled], dim=1)
+            full = torch.argmax(y_hat[filled], dim=1)
+            stats['checked_px'] = cached.numel()
+            stats['agree_px'] = int((cached == full).sum())
+
+        stats['appearances'] = len(new)
+        self.add(stats)
+        return [logits]
+
+    def put(self, key, output):
+        """
+        Adds model output of appearance to cache.
+
+        Parameters
+        ------
+        key: tuple
+            Appearance key.
+        output: torch.Tensor
+            Model output logits of tile [CHW].
+        """
+        self.cache[key] = output
+        self.cache_bytes += output.element_size() * output.numel()
+
+    def evict(self):
+        """
+        Removes least recently used appearances until the cache is
+        within the size limit. Returns number of evicted appearances.
+        """
+        evicted = 0
+        while self.cache and self.cache_bytes > self.max_size:
+            _, output = self.cache.popitem(last=False)
+            self.cache_bytes -= output.element_size() * output.numel()
+            evicted += 1
+        return evicted
+
+    def add(self, stats):
+        """
+        Adds statistics record to run totals.
+
+        Parameters
+        ------
+        stats: dict
+            Statistics record.
+        """
+        with self.lock:
+            for key, value in stats.items():
+                self.stats[key] = self.stats.get(key, 0) + value
+
+    def collect(self):
+        """
+        Returns and resets statistics (e.g. of a worker process).
+        """
+        with self.lock:
+            stats, self.stats = self.stats, self.get_empty()
+        return stats
+
+    def merge(self, stats):
+        """
+        Merges statistics (e.g. returned by a worker process).
+
+        Parameters
+        ------
+        stats: dict
+            Statistics record.
+        """
+        if stats:
+            self.add(stats)
+
+    def print_report(self):
+        """
+        Prints uniform tile report to console.
+        """
+        s = self.stats
+        hline = '-' * 40
+        print('\nUniform Tiles')
+        print(hline)
+        print('{:30s} {}'.format('Tiles', s['tiles']))
+        print('{:30s} {} ({:.1f}%)'.format('Uniform tiles', s['uniform'], 100 * s['uniform'] / max(1, s['tiles'])))
+        print('{:30s} {}'.format('Appearances cached', s['appearances']))
+        print('{:30s} {}'.format('Appearances evicted', s['evicted']))
+        print('{:30s} {} ({:.1f}%)'.format('Filled from cache', s['filled'], 100 * s['filled'] / max(1, s['tiles'])))
+        print('{:30s} {}'.format('Batches without forward pass', s['batches_skipped']))
+        if self.check:
+            print('{:30s} {}'.format('Forward passes avoided', '0 (check mode)'))
+            if s['checked_px']:
+                print('{:30s} {:.2f}%'.format('Agreement with full run', 100 * s['agree_px'] / s['checked_px']))
+        else:
+            print('{:30s} {}'.format('Forward passes avoided', s['filled']))
+            if s['forward_tiles']:
+                saved = s['filled'] * s['forward_time'] / s['forward_tiles']
+                print('{:30s} {:.2f}s'.format('Est. inference time saved', saved))
+        print(hline)
+
+
+# Create uniform tile screening instance (stopped)
+uniform_tiles: UniformTiles = UniformTiles()
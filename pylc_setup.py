@@ -22,22 +22,23 @@
  ***************************************************************************/
 """
 
-from qgis.PyQt.QtWidgets import QFileDialog, QMessageBox
+from qgis.PyQt.QtWidgets import QFileDialog, QMessageBox, QProgressDialog
+from qgis.PyQt.QtCore import Qt
+from qgis.core import QgsApplication
 
 from .interface_tools import addImg, errorMessage
 from .refresh import messageBox
 
-import cv2
 import tempfile
 import sys
 import os.path
-import numpy as np
 
 # Import the code for pylc
 this_dir = os.path.dirname(os.path.realpath(__file__))
 path = os.path.join(this_dir, 'pylc_ia')
 sys.path.append(path)
 import pylc
+from utils.control import CancelToken, CancelledError, PyLCError
 
 #PYLC SPECIFIC FUNCTIONS
 
@@ -75,6 +76,9 @@ def pylcArgs(dlg):
     if scale_val < 0.1 or scale_val > 1.0:
         errorMessage("Scale must be between 0.1 and 1.0")
         return
+
+    # PyLC saves the scaled input image for display (avoids decoding it again)
+    scaled_path = os.path.join(tempfile.mkdtemp(), 'resizedImg.tiff') if scale_val != 1.0 else None
         
     # Set up model arguments
     args = {'schema':None, 
@@ -85,13 +89,38 @@ def pylcArgs(dlg):
             'save_logits':None, 
             'aggregate_metrics':None,
             'mask_path':dlg.PyLC_path,
-            'save_probs': True
+            'scaled_path':scaled_path,
+            'save_probs': True,
+            'save_class_probs': True,
+            'mask_format': 'index',
+            'result_cache': True,
+            'cache_dir': os.path.join(QgsApplication.qgisSettingsDirPath(), 'cache', 'pylc') # user profile (kept across plugin updates)
             }
 
     # Check for optional model arguments (decided to get rid of this for V1)
     
     return args
 
+def getProgress():
+    """Returns classification progress dialog and its cancellation token"""
+
+    progressDlg = QProgressDialog("Running classification...", "Cancel", 0, 0)
+    progressDlg.setWindowModality(Qt.WindowModal)
+    progressDlg.setAutoReset(False) # reused for each image (closed after run)
+    progressDlg.setAutoClose(False)
+    progressDlg.setValue(0)
+    progressDlg.forceShow()
+    progressDlg.show()
+    cancel = CancelToken()
+    progressDlg.canceled.connect(cancel.cancel)
+    return progressDlg, cancel
+
+def updateProgress(progressDlg, value, maximum):
+    """Updates classification progress dialog (processes pending events, e.g. cancel)"""
+
+    progressDlg.setMaximum(maximum)
+    progressDlg.setValue(value)
+
 def enableTools(dlg):
     """Enables canvas tools once canvas is populated with mask and image"""
 
@@ -112,25 +141,26 @@ def runPylc(dlg):
     pylc_args = pylcArgs(dlg) # get pylc args
     if pylc_args is None:
         return # exit if there was an error getting the arguments
-    pylc.main(pylc_args) # run pylc
+
+    # Progress dialog: PyLC reports progress and stops when cancelled
+    progressDlg, cancel = getProgress()
+    pylc_args['progress'] = lambda value, maximum, label: updateProgress(progressDlg, value, maximum)
+    pylc_args['cancel'] = cancel
+    try:
+        dlg.pylc_result = pylc.main(pylc_args)[0] # run pylc (outputs are saved from the result)
+    except CancelledError:
+        return
+    except PyLCError as err:
+        errorMessage(str(err))
+        return
+    finally:
+        progressDlg.close()
     dlg.pylc_run = True
     
     # Display output
-    scale_val = dlg.Scale_lineEdit.text()
-
-    # Resize reference image if PyLC was scaled
-    scale = float(scale_val)
-    if scale != 1.0:
-        ref_img = cv2.imread(dlg.InputImg_lineEdit.text()) # load reference image
-        height, width = ref_img.shape[:2]
-        dim = (int(scale * width), int(scale * height))
-        resized_img = cv2.resize(ref_img, dim, interpolation=cv2.INTER_AREA) # for downscaling an image
-        img_path = os.path.join(tempfile.mkdtemp(), 'resizedImg.tiff')
-        if os.path.isfile(img_path):
-            # check if the temporary file already exists
-            os.remove(img_path)
-        cv2.imwrite(img_path, resized_img)
-
+    # - use scaled input image saved by PyLC if PyLC was scaled
+    if pylc_args['scaled_path'] is not None:
+        img_path = pylc_args['scaled_path']
     else:
         img_path = dlg.InputImg_lineEdit.text()
              
@@ -142,7 +172,6 @@ def runPylc(dlg):
 def saveMask(dlg):
     """Saves mask to file"""
 
-    mask = cv2.imread(dlg.PyLC_path)
     mask_path = None
 
     # open save dialog and save aligned image
@@ -155,17 +184,16 @@ def saveMask(dlg):
     if dialog.exec_():
         mask_path = dialog.selectedFiles()[0]
 
-        cv2.imwrite(mask_path, mask)
+        # link (or copy) PyLC outputs to save path (no image decoding/encoding)
+        save_name, ext = os.path.splitext(os.path.realpath(mask_path))
+        probs_save = os.path.join(save_name + '.npy') if dlg.pylc_result.probs_path else None
+        class_probs_save = os.path.join(save_name + '_classprobs.npy') if dlg.pylc_result.class_probs_path else None
+        try:
+            dlg.pylc_result.save(mask_path, probs_save, class_probs_save)
+        except (OSError, PyLCError) as err:
+            errorMessage(str(err))
+            return
         dlg.refresh_dict["PyLC"]["Mask"]=mask_path
-
-        mask_name, ext = os.path.splitext(os.path.realpath(dlg.PyLC_path))
-        probs_file = os.path.join(mask_name + '.npy')
-
-        if os.path.exists(probs_file):
-            probs = np.load(probs_file)
-            save_name, ext = os.path.splitext(os.path.realpath(mask_path))
-            probs_save = os.path.join(save_name + '.npy')
-            np.save(probs_save, probs)
     else:
         return
 
@@ -88,6 +88,7 @@ def refresh_PyLC(dlg, canvas_list):
     dlg.refresh_dict["PyLC"]["Mask"]=None
     dlg.PyLC_path = None
     dlg.pylc_run = False
+    dlg.pylc_result = None
 
 def checkCamParams(dlg):
     """Check if all camera parameters are empty"""
@@ -235,6 +236,7 @@ def refresh_align(dlg, canvas_list):
     dlg.aligned_img_path = None
     dlg.aligned_mask_path = None
     dlg.aligned_probs_path = None
+    dlg.aligned_class_probs_path = None
 
 def refresh_VS(dlg, canvas_list):
     """Refresh UI in VS tab"""
@@ -266,4 +268,5 @@ def refresh_VS(dlg, canvas_list):
     # refresh save filepaths
     dlg.refresh_dict["VS"]["VS"] = None
     dlg.vs_path = None
-    dlg.probs_lyr_path = None
\ No newline at end of file
+    dlg.probs_lyr_path = None
+    dlg.class_probs_lyr_path = None
\ No newline at end of file
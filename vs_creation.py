@@ -34,12 +34,22 @@ import math
 import scipy
 import cv2
 import tempfile
+import shutil
+import sys
 import os
 
 from .interface_tools import errorMessage, loadLayer
 from .vp_creation import reprojectDEM
 from .refresh import messageBox
 
+# Import PyLC class raster tools
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'pylc_ia'))
+from utils.tools import read_class_raster
+from config import defaults
+
+# Singleband legend codes (see sb_PyLC_style.qml), by sum of PyLC class colour channels
+SB_CODES = {207: 1, 420: 2, 376: 3, 227: 4, 255: 5, 413: 6, 259: 7, 489: 8, 500: 9}
+
 def initCamParams(dlg):
     """Read initial camera parameters from text file"""
 
@@ -130,16 +140,27 @@ def drawViewshed(dlg):
         errorMessage("Camera off DEM")
         return
     
-    # read mask from user input
+    # read mask from user input (PyLC class rasters are read as class indices)
     mask_path = os.path.realpath(dlg.AlignMask_lineEdit.text())
-    mask = cv2.imread(mask_path)
+    palette = None
+    raster = read_class_raster(mask_path)
+    if raster is not None:
+        mask, palette = raster
+    else:
+        mask = cv2.imread(mask_path)
 
     # check for probability layer and read it in
     mask_name, ext = os.path.splitext(os.path.realpath(dlg.AlignMask_lineEdit.text()))
     probs_path = os.path.join(mask_name + '.npy')
     probs = None
     if os.path.isfile(probs_path):
-        probs = np.load(probs_path)
+        probs = np.load(probs_path, mmap_mode='r') # read lazily (columns are sampled below)
+
+    # check for per-class probabilities (PyLC output) and read lazily (in column bands below)
+    class_probs_path = os.path.join(mask_name + '_classprobs.npy')
+    class_probs = None
+    if os.path.isfile(class_probs_path):
+        class_probs = np.load(class_probs_path, mmap_mode='r')
 
     img_h, img_w, *_ = mask.shape # get height and width of mask
     cam_x, cam_y, pixelSizeX, pixelSizeY = camXY(DEM_layer, cam_params["lat"], cam_params["lon"]) # find pixel coordinates of camera position and raster resolution
@@ -152,11 +173,21 @@ def drawViewshed(dlg):
     # create blank viewshed (same size as DEM)
     dem_h, dem_w, *_ = DEM_img.shape
 
-    vs = np.ones((dem_h,dem_w, 3),dtype=np.uint8)
+    if palette is not None:
+        vs = np.full((dem_h,dem_w), 255, dtype=np.uint8) # class indices (255 is ND)
+    else:
+        vs = np.ones((dem_h,dem_w, 3),dtype=np.uint8)
     # create probability layer if using
     probs_lyr = None
     if probs is not None:
         probs_lyr = np.ones((dem_h,dem_w),dtype=np.float32)
+    # create per-class probability layers if using (memory-mapped temporary file, one layer per legend code)
+    class_probs_lyr = None
+    if class_probs is not None:
+        legend = legendIndex(palette if palette is not None else defaults.palette_rgb)
+        class_probs_lyr = np.lib.format.open_memmap(
+            os.path.join(tempfile.mkdtemp(), 'tempClassProbs.npy'), mode='w+', dtype=np.uint8, shape=(len(legend), dem_h, dem_w))
+        band_w = 256 # number of image columns of per-class probabilities read at once
     
     xmins, xmaxs, ymins, ymaxs = [], [], [], [] # initiate variables to find visible extent for clipping later
 
@@ -234,6 +265,12 @@ def drawViewshed(dlg):
         if probs_lyr is not None:
             probs_lyr[ys_visible, xs_visible] = probs[y_coords_inbounds, img_x]
 
+        # if per-class probabilities exist, also fill into class probability layers
+        if class_probs_lyr is not None:
+            if img_x % band_w == 0:
+                class_cols = readClassBand(class_probs, legend, img_x, min(img_w, img_x + band_w))
+            class_probs_lyr[:, ys_visible, xs_visible] = class_cols[:, y_coords_inbounds, img_x % band_w]
+
     # find visible extents to clip VS later   
     xmin = ex.xMinimum() + min(xmins)*pixelSizeX
     xmax = ex.xMinimum() + max(xmaxs)*pixelSizeX
@@ -241,7 +278,25 @@ def drawViewshed(dlg):
     ymin = ex.yMaximum() - max(ymaxs)*pixelSizeY
     vis_ex = [xmin, xmax, ymin, ymax]
 
-    return vs, DEM_layer, vis_ex, probs_lyr
+    return vs, DEM_layer, vis_ex, probs_lyr, class_probs_lyr, palette
+
+def legendIndex(palette):
+    """Finds PyLC class index of each singleband legend code (1 to n), None if code has no class"""
+
+    classes = {SB_CODES.get(int(sum(colour))): i for i, colour in enumerate(palette)}
+
+    return [classes.get(code) for code in range(1, max(SB_CODES.values()) + 1)]
+
+def readClassBand(class_probs, legend, x0, x1):
+    """Reads image columns of per-class probabilities in legend order (from memory-mapped array)"""
+
+    h = class_probs.shape[1]
+    band = np.zeros((len(legend), h, x1 - x0), dtype=np.uint8)
+    for code, i in enumerate(legend):
+        if i is not None and i < class_probs.shape[0]:
+            band[code] = class_probs[i, :, x0:x1]
+
+    return band
 
 def singleBand(vs):
     """Converts viewshed to singleband layer based on PyLC classes"""
@@ -249,22 +304,33 @@ def singleBand(vs):
     # convert to singleband
     vs_sb = np.sum(vs, 2)
 
-    # convert to correct legend (1 to 8 for classes, 0 is ND)
+    # convert to correct legend (1 to 9 for classes, 0 is ND)
     vs_sb[vs_sb == 3] = 0
-    vs_sb[vs_sb == 207] = 1
-    vs_sb[vs_sb == 420] = 2
-    vs_sb[vs_sb == 376] = 3
-    vs_sb[vs_sb == 227] = 4
-    vs_sb[vs_sb == 255] = 5
-    vs_sb[vs_sb == 413] = 6
-    vs_sb[vs_sb == 259] = 7
-    vs_sb[vs_sb == 489] = 8
-    vs_sb[vs_sb == 500] = 9
+    for colour_sum, code in SB_CODES.items():
+        vs_sb[vs_sb == colour_sum] = code
 
     vs_sb_int = vs_sb.astype(int)
     
     return(vs_sb_int)
 
+def classBand(vs, palette):
+    """Converts class index viewshed to singleband layer based on PyLC classes"""
+
+    # look up legend code of each class colour (255 is ND)
+    lut = np.zeros(256, dtype=np.uint8)
+    for i, colour in enumerate(palette[:255]):
+        lut[i] = SB_CODES.get(int(sum(colour)), 0)
+
+    return lut[vs]
+
+def colourBand(vs, palette):
+    """Converts class index viewshed to BGR image of class colours"""
+
+    lut = np.ones((256, 3), dtype=np.uint8) # ND
+    lut[:min(len(palette), 255)] = np.array(palette[:255], dtype=np.uint8)[:, ::-1]
+
+    return lut[vs]
+
 def clipVSLayer(vs_layer, vis_ex):
     """Clip viewshed to visible area"""
 
@@ -316,6 +382,30 @@ def createVSLayer(vs_path, DEM_lyr, vis_ex):
 
     return vs_clip_path, vs_clip_layer  
 
+def clipClassProbs(class_probs_lyr, DEM_lyr, vs_layer):
+    """Clips per-class probability layers (DEM grid) to clipped viewshed layer grid"""
+
+    # find viewshed layer window on DEM grid
+    ext = DEM_lyr.extent()
+    vs_ext = vs_layer.extent()
+    col0 = round((vs_ext.xMinimum() - ext.xMinimum())/DEM_lyr.rasterUnitsPerPixelX())
+    row0 = round((ext.yMaximum() - vs_ext.yMaximum())/DEM_lyr.rasterUnitsPerPixelY())
+    w, h = vs_layer.width(), vs_layer.height()
+
+    # copy window one class layer at a time into a memory-mapped temporary file
+    n, dem_h, dem_w = class_probs_lyr.shape
+    clip_path = os.path.join(tempfile.mkdtemp(), 'tempClassProbs.npy')
+    clipped = np.lib.format.open_memmap(clip_path, mode='w+', dtype=np.uint8, shape=(n, h, w))
+    r0, r1 = max(0, row0), min(dem_h, row0 + h)
+    c0, c1 = max(0, col0), min(dem_w, col0 + w)
+    if r0 < r1 and c0 < c1:
+        for i in range(n):
+            clipped[i, r0 - row0:r1 - row0, c0 - col0:c1 - col0] = class_probs_lyr[i, r0:r1, c0:c1]
+    clipped.flush()
+    del clipped
+
+    return clip_path
+
 def showMask(dlg):
     """Adds aligned mask to QGraphics View"""
 
@@ -348,7 +438,7 @@ def createVS(dlg):
         if ret == QMessageBox.No:
             return
     try:
-        vs, DEM_layer, vis_ex, probs_lyr = drawViewshed(dlg) # create viewshed using ray tracing
+        vs, DEM_layer, vis_ex, probs_lyr, class_probs_lyr, palette = drawViewshed(dlg) # create viewshed using ray tracing
     except TypeError:
         errorMessage("Viewshed creation failed.")
         return
@@ -359,7 +449,10 @@ def createVS(dlg):
         return
     
     if dlg.image_checkBox.isChecked():
-        vs = singleBand(vs) # if PyLC mask provided, convert to singleband
+        # if PyLC mask provided, convert to singleband
+        vs = classBand(vs, palette) if palette is not None else singleBand(vs)
+    elif palette is not None:
+        vs = colourBand(vs, palette) # class raster not styled as PyLC mask, write class colours
     
     # save vs to temp path
     dlg.vs_path = os.path.join(tempfile.mkdtemp(), 'tempVS.tiff')
@@ -382,6 +475,11 @@ def createVS(dlg):
         cv2.imwrite(dlg.probs_lyr_path, probs_img) # write viewshed to image
         dlg.probs_lyr_path, probs_ref_layer = createVSLayer(dlg.probs_lyr_path, DEM_layer, vis_ex) # convert viewshed from image to referenced raster layer, update path to VS layer
 
+    # if per-class probabilities exist, clip to viewshed layer grid (read by probability mosaic)
+    dlg.class_probs_lyr_path = None
+    if class_probs_lyr is not None:
+        dlg.class_probs_lyr_path = clipClassProbs(class_probs_lyr, DEM_layer, vs_ref_layer)
+
 
     QgsProject.instance().addMapLayer(vs_ref_layer, False) # add layer to the registry (but don't load into main map)
     QgsProject.instance().addMapLayer(DEM_layer, False) # add layer to the registry (but don't load into main map)
@@ -452,6 +550,11 @@ def saveVS(dlg):
             save_probs_path = os.path.join(save_path + '_probs.tiff')
             writeRaster(probs, save_probs_path, dest_crs)
 
+        if dlg.class_probs_lyr_path is not None:
+            # per-class probabilities (same grid as viewshed)
+            save_path, ext = os.path.splitext(save_vs_path)
+            shutil.copyfile(dlg.class_probs_lyr_path, os.path.join(save_path + '_classprobs.npy'))
+
         dlg.refresh_dict["VS"]["VS"]=save_vs_path
     else:
         return
\ No newline at end of file